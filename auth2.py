@@ -3,12 +3,34 @@ import jwt
 import json
 import time
 import os
+import threading
 from dotenv import dotenv_values
+try:
+    import fcntl # file locking of shared token cache, not available on Windows
+except ImportError:
+    fcntl = None
 class Auth2Token():
-    def __init__(self, path):
+    def __init__(self, path, env=".env", token_file="./.token", token_url="https://oauth2.googleapis.com/token",
+                 refresh_before=300):
         self.path = path # path to private key file
+        self.env = env # path to env file with creditionals of service account
+        self.token_file = token_file # shared on-disk cache of access token, None disables it
+        self.token_url = token_url
+        self.refresh_before = refresh_before # seconds before expiry when token is refreshed
+        self.config = None
+        self.private_key = None
+        self.access_token = None
+        self.expires_at = 0
+        self.refreshes = 0 # access tokens requested by this process
+        self.lock = threading.Lock()
+    def load(self): # config and private key are read only once per process
+        if self.config is None:
+            self.config = dotenv_values(self.env) # load data from env file into dict
+            with open(self.path, "rb") as private_key:
+                self.private_key = private_key.read() # read data from file
+        return self.config
     def generate_jwt_token(self): # method for generating JWT token based on creditionals of service account in order to get access token
-        config = dotenv_values(".env") # load data from env file into dict  
+        config = self.load()
         claims = {
             "iss": config["ISS"],
             "scope": config["SCOPE"],
@@ -18,27 +40,80 @@ class Auth2Token():
         }
         headers = {
             "alg": config["ALG"],
-            "typ": config["TYPE"], 
+            "typ": config["TYPE"],
             "kid":config["KID"]
         }
-        private_key = open(self.path, "rb")
-        content = private_key.read() # read data from file
-        encoded = jwt.encode(payload=claims,key=content,headers=headers) # generating jwt token
-        private_key.close()
+        encoded = jwt.encode(payload=claims,key=self.private_key,headers=headers) # generating jwt token
         return encoded
-    def get_access_token(self):
-        if os.path.exists("./.token"):
-            access_token_file = open("./.token", "r")
-            content_access_token = access_token_file.read() 
-            access_token_file.close()
-            return content_access_token
-        else:
-            raise LookupError("Error occured because file into ./.token doesn't exist(Generate file first)")
-    def generate_new_access_token(self):
+    def is_valid(self, expires_at):
+        return time.time() < expires_at - self.refresh_before
+    def lock_file(self, exclusive):
+        # lock of shared token cache, parallel processes wait here while one of them refreshes token
+        if self.token_file is None or fcntl is None:
+            return None
+        handle = open(self.token_file + ".lock", "a")
+        fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return handle
+    def unlock_file(self, handle):
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+    def read_token_file(self):
+        if self.token_file is None or not os.path.exists(self.token_file):
+            return (None, 0)
+        try:
+            with open(self.token_file, "r") as access_token_file:
+                content = json.load(access_token_file)
+            return (content["access_token"], content["expires_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return (None, 0) # missing, partial or old format of token file
+    def write_token_file(self, access_token, expires_at):
+        if self.token_file is None:
+            return
+        temporary = f"{self.token_file}.{os.getpid()}.tmp"
+        with open(temporary, "w") as access_token_file:
+            json.dump({"access_token": access_token, "expires_at": expires_at}, access_token_file)
+        os.replace(temporary, self.token_file) # readers never see partially written token
+    def request_access_token(self):
         jwt_token = self.generate_jwt_token()
-        headers = {'Content-Type': 'application/x-www-form-urlencoded', "Host": "oauth2.googleapis.com"}
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
         data = "grant_type=urn%3Aietf%3Aparams%3Aoauth%3Agrant-type%3Ajwt-bearer&assertion="+jwt_token
-        response = json.loads(requests.post("https://oauth2.googleapis.com/token", data=data, headers=headers).text) ## make post request and parse response into json format
-        access_token_file = open("./.token", "w")
-        access_token_file.write(response["access_token"]) # write access token to file
-        access_token_file.close()
+        response = requests.post(self.token_url, data=data, headers=headers)
+        response.raise_for_status()
+        content = response.json() ## parse response into json format
+        return (content["access_token"], time.time() + int(content.get("expires_in", 3600)))
+    def refresh(self, failed_token=None):
+        # called with self.lock held, token from shared cache is reused when it's valid and isn't the one which failed
+        handle = self.lock_file(exclusive=True)
+        try:
+            (access_token, expires_at) = self.read_token_file()
+            if access_token is None or access_token == failed_token or not self.is_valid(expires_at):
+                (access_token, expires_at) = self.request_access_token()
+                self.refreshes += 1
+                self.write_token_file(access_token, expires_at)
+            self.access_token = access_token
+            self.expires_at = expires_at
+        finally:
+            self.unlock_file(handle)
+    def get_access_token(self):
+        # valid token from memory, then from shared cache, otherwise new one is requested shortly before expiry
+        with self.lock:
+            if self.access_token is not None and self.is_valid(self.expires_at):
+                return self.access_token
+            handle = self.lock_file(exclusive=False)
+            try:
+                (access_token, expires_at) = self.read_token_file()
+            finally:
+                self.unlock_file(handle)
+            if access_token is not None and self.is_valid(expires_at):
+                self.access_token = access_token
+                self.expires_at = expires_at
+            else:
+                self.refresh()
+            return self.access_token
+    def generate_new_access_token(self, failed_token=None):
+        # refresh after 401 of failed_token, nothing is requested when other thread or process already replaced it
+        with self.lock:
+            if failed_token is not None and self.access_token != failed_token and self.is_valid(self.expires_at):
+                return
+            self.refresh(failed_token)
@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from mock_apigee import MockApigeeServer, SyntheticOrganization
+ENV = """ISS=benchmark@mock-org.iam.gserviceaccount.com
+SCOPE=https://www.googleapis.com/auth/cloud-platform
+AUD=https://oauth2.googleapis.com/token
+ALG=RS256
+TYPE=JWT
+KID=benchmark
+"""
+def create_credentials(directory):
+    # throwaway service account key, mock OAuth server accepts any signed assertion
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(os.path.join(directory, "key.pem"), "wb") as private_key:
+        private_key.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption()))
+    with open(os.path.join(directory, ".env"), "w") as env:
+        env.write(ENV)
+def run_extraction(args):
+    # runs in own process, so peak RSS belongs to extraction only and not to mock server
+    from auth2 import Auth2Token
+    from cache import BundleCache
+    from extracter import ExtracterApigeeResources
+    os.chdir(args.directory)
+    aouth2 = Auth2Token("key.pem", token_url=f"http://{args.domain}/token")
+    cache = BundleCache(enabled=args.cache)
+    extracter = ExtracterApigeeResources(domain=args.domain, scheme="http", organization=args.organization,
+                                         workers=args.workers, cache=cache, bulk=args.bulk, aouth2=aouth2)
+    start = time.perf_counter()
+    extracter.build_hierarchy(args.output)
+    wall = time.perf_counter() - start
+    print(json.dumps({"wall": wall, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+def run_case(proxies, args):
+    organization = SyntheticOrganization(proxies=proxies, sharedflows=max(10, proxies // 20), apiproducts=max(5, proxies // 5),
+                                         apps=max(10, proxies // 2), developers=max(5, proxies // 5), bundle_size=args.bundle_size)
+    server = MockApigeeServer(organization, latency=args.latency, rate_limit=args.rate_limit).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            create_credentials(directory)
+            command = [sys.executable, os.path.abspath(__file__), "--extract", "--directory", directory,
+                       "--domain", f"{server.server_address[0]}:{server.server_address[1]}",
+                       "--organization", organization.name, "--workers", str(args.workers),
+                       "--output", os.path.join(directory, "hierarchy.json")]
+            command += (["--bulk"] if args.bulk else []) + (["--cache"] if args.cache else [])
+            process = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if process.returncode != 0:
+                raise RuntimeError(f"Extraction of {proxies} proxies failed:\n{process.stderr}")
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+    finally:
+        server.shutdown()
+        server.server_close()
+    result["proxies"] = proxies
+    result["requests"] = server.requests
+    result["requests_per_second"] = server.requests / result["wall"]
+    result["bytes"] = server.bytes_sent
+    result["throttled"] = server.throttled
+    return result
+def compare(results, baseline, tolerance):
+    # regression when wall time or number of requests grows more than tolerance against baseline
+    regressions = []
+    previous = {result["proxies"]: result for result in baseline}
+    for result in results:
+        if result["proxies"] not in previous:
+            continue
+        for metric in ["wall", "requests"]:
+            if result[metric] > previous[result["proxies"]][metric] * (1 + tolerance):
+                regressions.append(f"{result["proxies"]} proxies: {metric} {result[metric]:.2f} > baseline {previous[result["proxies"]][metric]:.2f}")
+    return regressions
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark build_hierarchy against local mock Apigee API")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="number of proxies of synthetic organizations")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--bulk", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="use bundle cache (disabled by default so every run downloads bundles)")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added by mock server to every request")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--bundle-size", type=int, default=16*1024, help="bytes of padding in every bundle")
+    parser.add_argument("--json", help="save results into file")
+    parser.add_argument("--baseline", help="results of earlier run (--json), exit with 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against baseline")
+    parser.add_argument("--extract", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    parser.add_argument("--domain", help=argparse.SUPPRESS)
+    parser.add_argument("--organization", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.extract:
+        run_extraction(args)
+        sys.exit(0)
+    results = []
+    print(f"{"proxies":>8} {"wall s":>9} {"req":>8} {"req/s":>9} {"MB sent":>9} {"429":>6} {"peak MB":>9}")
+    for proxies in args.sizes:
+        result = run_case(proxies, args)
+        results.append(result)
+        print(f"{proxies:>8} {result["wall"]:>9.2f} {result["requests"]:>8} {result["requests_per_second"]:>9.1f} "
+              f"{result["bytes"] / 1024 / 1024:>9.2f} {result["throttled"]:>6} {result["peak_rss_mb"]:>9.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as report:
+            json.dump(results, report, indent=4)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as report:
+            regressions = compare(results, json.load(report), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,83 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+VERSION = 2 # bumped whenever shape of cached value changes, entries of older versions are never read and age out
+class BundleCache():
+    # persistent cache of parsed bundle dependencies, revisions in Apigee are immutable
+    # so result for organization/proxy/revision never changes once it's stored
+    def __init__(self, path=".bundle_cache", max_bytes=256*1024*1024, enabled=False):
+        self.path = path
+        self.max_bytes = max_bytes # cache is trimmed to this size, least recently used entries go first
+        self.enabled = enabled # disabled cache touches no files, extracter command line enables it
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self.index = OrderedDict() # file -> size, least recently used first, directory is scanned only once here
+        if self.enabled:
+            os.makedirs(self.path, exist_ok=True)
+            for (file, size, mtime) in sorted(self.entries(), key=lambda entry: entry[2]):
+                self.index[file] = size
+            self.size = sum(self.index.values())
+    def key(self, organization, kind, name, revision):
+        return hashlib.sha256(f"{VERSION}/{organization}/{kind}/{name}/{revision}".encode("utf-8")).hexdigest()
+    def file(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.json")
+    def entries(self):
+        entries = []
+        for directory in os.scandir(self.path):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    if entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+    def get(self, organization, kind, name, revision):
+        if not self.enabled:
+            return None
+        file = self.file(self.key(organization, kind, name, revision))
+        try:
+            with open(file, "r", encoding="utf-8") as cached:
+                value = json.load(cached)
+            os.utime(file) # mark entry as recently used
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            if file in self.index:
+                self.index.move_to_end(file)
+        return value
+    def put(self, organization, kind, name, revision, value):
+        if not self.enabled:
+            return
+        file = self.file(self.key(organization, kind, name, revision))
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        content = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        (descriptor, temporary) = tempfile.mkstemp(dir=os.path.dirname(file), suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as cached:
+            cached.write(content)
+        os.replace(temporary, file) # atomic, concurrent readers never see partial entry
+        with self.lock:
+            self.size += len(content) - self.index.pop(file, 0)
+            self.index[file] = len(content)
+            if self.size > self.max_bytes:
+                self.evict()
+    def evict(self):
+        # called with lock held, drops least recently used entries of in-memory index, cost is only number of evicted entries
+        while self.size > self.max_bytes and len(self.index) > 0:
+            (file, size) = self.index.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(file)
+            except OSError:
+                continue # already removed e.g. by other process sharing cache directory
+            self.evictions += 1
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "bytes": self.size}
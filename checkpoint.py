@@ -0,0 +1,104 @@
+import json
+import time
+import sqlite3
+import threading
+import traceback
+class CheckpointStore():
+    # durable store of entities completed during extraction, run interrupted halfway can be resumed from it,
+    # entities which failed are recorded with their error instead of aborting whole run
+    def __init__(self, path=".checkpoint.sqlite", organization="", enabled=False, resume=False, interval=5.0):
+        self.path = path
+        self.organization = organization
+        self.enabled = enabled # disabled store only keeps failures in memory, extracter command line enables it
+        self.resume = resume # reuse entities completed by previous run, otherwise checkpoint starts empty
+        self.interval = interval # seconds between two commits
+        self.lock = threading.Lock()
+        self.failures = [] # failures of this run, kept even when checkpoint is disabled
+        self.restored = 0
+        self.committed = time.monotonic()
+        self.connection = None
+        if self.enabled:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS entity (organization TEXT, kind TEXT, name TEXT, data TEXT, "
+                                    "PRIMARY KEY (organization, kind, name))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS failure (organization TEXT, kind TEXT, name TEXT, error TEXT, "
+                                    "PRIMARY KEY (organization, kind, name))")
+            if not self.resume:
+                self.clear()
+            self.connection.commit()
+    def bind(self, organization):
+        # organization is known only when extracter is created, store can be created before it
+        if organization != self.organization:
+            self.organization = organization
+            if self.enabled and not self.resume:
+                self.clear()
+    def get(self, kind, name):
+        if not self.enabled or not self.resume:
+            return None
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM entity WHERE organization=? AND kind=? AND name=?",
+                                          (self.organization, kind, name)).fetchone()
+            if row is not None:
+                self.restored += 1
+        return json.loads(row[0]) if row is not None else None
+    def put(self, kind, name, data):
+        if not self.enabled:
+            return
+        content = json.dumps(data, ensure_ascii=False)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO entity VALUES (?, ?, ?, ?)", (self.organization, kind, name, content))
+            self.connection.execute("DELETE FROM failure WHERE organization=? AND kind=? AND name=?", (self.organization, kind, name))
+            if time.monotonic() - self.committed >= self.interval:
+                self.commit()
+    def fail(self, kind, name, error):
+        message = "".join(traceback.format_exception_only(type(error), error)).strip()
+        with self.lock:
+            self.failures.append({"kind": kind, "name": name, "error": message})
+            if self.enabled:
+                self.connection.execute("INSERT OR REPLACE INTO failure VALUES (?, ?, ?, ?)", (self.organization, kind, name, message))
+                self.commit()
+    def run(self, kind, name, function, nested=True):
+        # result of function is taken from checkpoint when it's already done, otherwise computed and stored,
+        # exception is recorded as failure of this entity and None is returned,
+        # with nested (entity like section runs other entities) result isn't stored when any failure happened meanwhile,
+        # so resume retries it
+        done = self.get(kind, name)
+        if done is not None:
+            return done
+        with self.lock:
+            failures = len(self.failures)
+        try:
+            result = function()
+        except Exception as error:
+            print(f"Failed {kind} {name}: {error}")
+            self.fail(kind, name, error)
+            return None
+        with self.lock:
+            complete = not nested or len(self.failures) == failures
+        if complete:
+            self.put(kind, name, result)
+        return result
+    def commit(self):
+        # called with lock held
+        if self.enabled:
+            self.connection.commit()
+        self.committed = time.monotonic()
+    def flush(self):
+        with self.lock:
+            self.commit()
+    def clear(self):
+        if self.enabled:
+            self.connection.execute("DELETE FROM entity WHERE organization=?", (self.organization,))
+            self.connection.execute("DELETE FROM failure WHERE organization=?", (self.organization,))
+            self.connection.commit()
+    def finish(self):
+        # run is complete: checkpoint is dropped unless some entities failed, then it's kept for --resume
+        with self.lock:
+            if self.enabled and len(self.failures) == 0:
+                self.clear()
+            self.commit()
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -2,16 +2,54 @@ import requests
 import json
 import zipfile
 import time
-import xml.etree.ElementTree as ET
+import tempfile
+import argparse
+import threading
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 from auth2 import Auth2Token
-from request import RestRequest
+from request import RestRequest, RETRY_ERRORS
+from scheduler import RequestScheduler
+from cache import BundleCache
+from graph import DependencyGraph
+from checkpoint import CheckpointStore
+from scanner import scan_bundle
+from store import SnapshotStore
+from writer import HierarchyWriter, load_hierarchy, detect_format, detect_compression, FORMATS
 class ExtracterApigeeResources():
     def __init__(self,domain="apigee.googleapis.com", 
-                 organization="gcp101027-apigeex"):
-        self.request = RestRequest()
+                 organization="gcp101027-apigeex", workers=1, bundle_memory=16*1024*1024,
+                 cache=None, bulk=False, page_size=1000, aouth2=None, rate=None,
+                 scheme="https", checkpoint=None):
+        scheduler = RequestScheduler(rate=rate, max_concurrency=max(1, workers)) # at most workers requests in flight, fewer when throttled
+        self.request = RestRequest(pool_size=max(10, workers), aouth2=aouth2, scheduler=scheduler) # keep one pooled connection per worker
+        self.metrics = self.request.metrics
         self.domain = domain
-        self.main_url = f"https://{self.domain}/v1/organizations/"
+        self.main_url = f"{scheme}://{self.domain}/v1/organizations/"
         self.organization = organization
+        self.workers = workers # number of concurrent requests, 1 means serial crawl
+        self.local = threading.local()
+        self.bundle_memory = bundle_memory # max bytes of bundle kept in memory before spilling to temporary file
+        self.cache = cache if cache is not None else BundleCache(enabled=False) # parsed bundle dependencies by organization/proxy/revision, persisted only when enabled
+        self.bulk = bulk # use organization level listings instead of request per proxy, sharedflow, apiproduct and flowhook
+        self.environments = None
+        self.checkpoint = checkpoint if checkpoint is not None else CheckpointStore(enabled=False) # completed entities and failures of run, persisted only when enabled
+        self.checkpoint.bind(organization)
+        self.page_size = page_size # items per page of apps, developers and apiproducts listings
+    def run_in_worker(self, function, item):
+        self.local.worker = True
+        try:
+            return function(item)
+        finally:
+            self.local.worker = False
+    def map(self, function, items):
+        # run function over items with bounded concurrency, results keep the order of items
+        # nested calls from a worker run serially so the number of requests in flight never exceeds workers
+        items = list(items)
+        if self.workers <= 1 or len(items) <= 1 or getattr(self.local, "worker", False):
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as executor:
+            return list(executor.map(lambda item: self.run_in_worker(function, item), items))
     def get_last_number_deployed_revision_proxy(self, name_proxy):
         response = self.request.get(f"{self.main_url}{self.organization}/apis/{name_proxy}/deployments")
         if (len(json.loads(response.text)) > 0):
@@ -37,115 +75,166 @@ class ExtracterApigeeResources():
         else:
             return -1
     def download_file(self,url):
-        # NOTE the stream=True parameter below
-        with self.request.get(url,stream=True) as r:
-            r.raise_for_status()
-            with open("temprorary.zip", 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192): 
-                    # If you have chunk encoded response uncomment if
-                    # and set chunk_size parameter to None.
-                    #if chunk: 
-                    f.write(chunk)
-    def get_sharedflows(self,url):
-        sharedflows = []
-        policy_list = []
-        self.download_file(url)
-        with zipfile.ZipFile("temprorary.zip") as arhive:
-            list_names = [object for object in arhive.namelist() if "apiproxy/policies/" in str(object)]
-            if len(list_names) > 0:
-                if "apiproxy/policies/" in list_names:
-                    list_names.remove("apiproxy/policies/")
-                    policy_list = [str(object).removeprefix("apiproxy/policies/") for object in list_names]
-                    flowcallout_list = self.filterpolicyBySharedflow(policy_list)
-                    if len(flowcallout_list) > 0:
-                        for flowcallout in flowcallout_list:
-                            with arhive.open("apiproxy/policies/"+flowcallout) as myfile:
-                                root_element = ET.fromstring(myfile.read())
-                                for sharedflow in root_element.findall('SharedFlowBundle'): 
-                                    sharedflows.append(sharedflow.text)
-        return (sharedflows,policy_list)
-    def filterpolicyBySharedflow(self, policies):
-        acronyms = ["AC-","AM-","AE-",
-                    "BA-","CRL-","EV-",
-                    "JS-","JC-", "JTP-", 
-                    "J2X-", "JtoX-", "KVM-",
-                    "LDAP-","ML-","PC-",
-                    "LC-","IC-", "SA-", 
-                    "QZ-", "VC-", "RC-",
-                    "OAuthv1-", "OAuthv2-","Python-", 
-                    "Q-", "RQ-", "RF-",
-                    "RE-", "MV-", "SAML-",
-                    "EC-", "JWT-", "JWS-",
-                    "SC-", "SA-","Stats-",
-                    "VAK-", "XMLTP-", "X2J-",
-                    "XSL-"] # filtering all known convient names of policy expect FC and others unknown))
-        sharedflows = []
-        for policy in policies:
-            structure_policy = str(policy).split("-")
-            if f"{structure_policy[0]}-" not in acronyms:
-                sharedflows.append(policy)
-        return sharedflows
-    def filterpolicyByKVM(self, policies):
-        acronyms = ["AC-","AM-","AE-",
-                    "BA-","CRL-","EV-",
-                    "JS-","JC-", "JTP-", 
-                    "J2X-", "JtoX-","LDAP-",
-                    "ML-","PC-","LC-",
-                    "IC-", "SA-", 
-                    "QZ-", "VC-", "RC-",
-                    "OAuthv1-", "OAuthv2-","Python-", 
-                    "Q-", "RQ-", "RF-",
-                    "RE-", "MV-", "SAML-",
-                    "EC-", "JWT-", "JWS-",
-                    "SC-", "SA-","Stats-",
-                    "VAK-", "XMLTP-", "X2J-",
-                    "XSL-", "FC-"] # filtering all known convient names of policy expect FC and others unknown))
-        sharedflows = []
-        for policy in policies:
-            structure_policy = str(policy).split("-")
-            if f"{structure_policy[0]}-" not in acronyms:
-                sharedflows.append(policy)
-        return sharedflows
-    def get_kvm_dependency(self,policy_list):
-        kvm = []
-        if len(policy_list) > 0: 
-            with zipfile.ZipFile("temprorary.zip") as archive:
-                flowcallout_list = self.filterpolicyByKVM(policy_list)
-                if len(flowcallout_list) > 0:
-                    for flowcallout in flowcallout_list:
-                            with archive.open("apiproxy/policies/"+flowcallout) as myfile:
-                                root_element = ET.fromstring(myfile.read())
-                                name_kvm = root_element.get("mapIdentifier")
-                                if name_kvm is not None and name_kvm not in kvm:
-                                    kvm.append(name_kvm)
-        return kvm
-    def get_proxies(self,includeRevisions=False,includeMetaData=False):
-        response = []
-        list_all_names_proxy = json.loads(self.request.get(f"{self.main_url}{self.organization}/apis?includeRevisions={includeRevisions}&includeMetaData={includeMetaData}").text)["proxies"] 
-        for proxy in list_all_names_proxy:
-            record = {}
-            record["type"] = "proxy"
-            record["name"] = proxy["name"]
-            record["revisions"] = {}
-            revisions = self.get_deployed_revisions_proxy(proxy["name"])
-            if revisions == -1:
-                revision_dependency = {}
-                resp = json.loads(self.request.get(f"{self.main_url}{self.organization}/apis/{proxy["name"]}",).text)
-                revision_dependency["enviroment"] = ""
-                record["revisions"][f"{resp["latestRevisionId"]}"] = revision_dependency
+        # bundle is kept in memory and spilled to anonymous temporary file only above bundle_memory bytes,
+        # so every worker has own buffer and nothing is shared on disk
+        # body is read after get() returns, so reset in the middle of bundle is retried here with the same backoff,
+        # errors of get() itself were already retried there and propagate
+        attempt = 0
+        while True:
+            buffer = tempfile.SpooledTemporaryFile(max_size=self.bundle_memory)
+            interrupted = False
+            try:
+                # NOTE the stream=True parameter below
+                with self.request.get(url,stream=True) as r:
+                    r.raise_for_status()
+                    try:
+                        for chunk in r.iter_content(chunk_size=8192): 
+                            buffer.write(chunk)
+                    except RETRY_ERRORS:
+                        if attempt == self.request.max_retries:
+                            raise
+                        interrupted = True
+            except BaseException:
+                buffer.close()
+                raise
+            if not interrupted:
+                break
+            self.metrics.record_bytes(url, buffer.tell())
+            buffer.close()
+            self.metrics.record_retry(url)
+            self.request.backoff(attempt)
+            attempt += 1
+        self.metrics.record_bytes(url, buffer.tell())
+        buffer.seek(0)
+        return buffer
+    def get_bundle_dependencies(self,url):
+        # single streaming pass over policies of proxy or sharedflow bundle, policy type is taken from its root element
+        # (see scanner.py) so references are found whatever the policy is named
+        buffer = self.download_file(url)
+        with self.metrics.phase("bundle_parse"), buffer, zipfile.ZipFile(buffer) as arhive:
+            references = scan_bundle(arhive)
+        for error in references["errors"]:
+            print(f"Skipped unreadable policy in {url}: {error}")
+        return references
+    def get_revision_dependency(self, name_proxy, revision):
+        cached = self.cache.get(self.organization, "proxy", name_proxy, revision["revision"])
+        if cached is None:
+            url = f"{self.main_url}{self.organization}/apis/{name_proxy}/revisions/{revision["revision"]}?format=bundle"
+            references = self.get_bundle_dependencies(url)
+            cached = {"kvms_dependency": references["kvm"], "sharedflow": references["sharedflow"], "cache": references["cache"]}
+            self.cache.put(self.organization, "proxy", name_proxy, revision["revision"], cached)
+        revision_dependency = {}
+        revision_dependency["kvms_dependency"] = cached["kvms_dependency"]
+        revision_dependency["sharedflow"] = cached["sharedflow"]
+        revision_dependency["cache_dependency"] = cached["cache"]
+        revision_dependency["enviroment"] = revision["environment"]
+        return revision_dependency
+    def get_sharedflow_revision_dependency(self, name_sharedflow, revision):
+        # sharedflows call other sharedflows and read kvms same way as proxies
+        cached = self.cache.get(self.organization, "sharedflow", name_sharedflow, revision)
+        if cached is None:
+            url = f"{self.main_url}{self.organization}/sharedflows/{name_sharedflow}/revisions/{revision}?format=bundle"
+            references = self.get_bundle_dependencies(url)
+            cached = {"kvms_dependency": references["kvm"], "sharedflow": references["sharedflow"], "cache": references["cache"]}
+            self.cache.put(self.organization, "sharedflow", name_sharedflow, revision, cached)
+        return cached
+    def get_latest_revision_proxy(self, name_proxy):
+        resp = json.loads(self.request.get(f"{self.main_url}{self.organization}/apis/{name_proxy}",).text)
+        return resp["latestRevisionId"]
+    def get_deployments(self, sharedflows=False, environments=None):
+        # all deployments of organization in one call, grouped by proxy (or sharedflow) name,
+        # when organization listing isn't available one listing per environment is used instead
+        response = self.request.get(f"{self.main_url}{self.organization}/deployments?sharedFlows={str(sharedflows).lower()}")
+        if response.ok or environments is None:
+            response.raise_for_status()
+            listings = [response.json()]
+        else:
+            listings = self.map(lambda env: self.get_deployments_environment(env, sharedflows), environments)
+        deployments = {}
+        for listing in listings:
+            for deployment in listing.get("deployments", []):
+                record = {}
+                record["revision"] = int(deployment["revision"])
+                record["environment"] = deployment["environment"]
+                deployments.setdefault(deployment["apiProxy"], []).append(record)
+        return deployments
+    def get_deployments_environment(self, environment, sharedflows=False):
+        response = self.request.get(f"{self.main_url}{self.organization}/environments/{environment}/deployments?sharedFlows={str(sharedflows).lower()}")
+        response.raise_for_status()
+        return response.json()
+    def is_proxy_unchanged(self, previous, proxy, revisions):
+        # proxy can be reused from previous snapshot when it has same revisions, same modification time and same deployments
+        if previous is None or "lastModifiedAt" not in previous:
+            return False
+        if previous["lastModifiedAt"] != proxy.get("metaData", {}).get("lastModifiedAt"):
+            return False
+        if previous.get("revision_list") != proxy.get("revision"):
+            return False
+        deployed = {(key, value["enviroment"]) for key,value in previous["revisions"].items() if value["enviroment"] != ""}
+        return self.is_deployment_unchanged(deployed, revisions if revisions != -1 else [])
+    def is_deployment_unchanged(self, deployed, revisions):
+        # deployed is set of (revision, environment) of previous record, revisions are current deployments
+        current = {(f"{revision["revision"]}", revision["environment"]) for revision in revisions}
+        if len(current) != len({key for (key, env) in current}):
+            return False # record keeps one environment per revision, revision deployed in several environments is always fetched again
+        return deployed == current
+    def is_sharedflow_unchanged(self, previous, sharedflow, revisions):
+        # same rules as for proxies: same revisions, same modification time and same deployments
+        if previous is None or "lastModifiedAt" not in previous:
+            return False
+        if previous["lastModifiedAt"] != sharedflow.get("metaData", {}).get("lastModifiedAt"):
+            return False
+        if previous.get("revision_list") != sharedflow.get("revision"):
+            return False
+        return self.is_deployment_unchanged({(key, value["environment"]) for key,value in previous["revisions"].items()}, revisions)
+    def get_proxy(self, proxy, revisions):
+        # record of one proxy with dependencies of every deployed revision, revisions is result of get_deployed_revisions_proxy
+        name = proxy["name"]
+        record = {}
+        record["type"] = "proxy"
+        record["name"] = name
+        record["revisions"] = {}
+        if revisions == -1:
+            if len(proxy.get("revision", [])) > 0:
+                latest_revision = str(max(int(revision) for revision in proxy["revision"]))
             else:
-                for revision in revisions:
-                    revision_dependency = {}
-                    url = f"{self.main_url}{self.organization}/apis/{proxy["name"]}/revisions/{revision["revision"]}?format=bundle"
-                    (list_sharedflow, policy) = self.get_sharedflows(url)
-                    list_kvms_dependency = self.get_kvm_dependency(policy)
-                    revision_dependency["kvms_dependency"] = list_kvms_dependency
-                    revision_dependency["sharedflow"] = list_sharedflow
-                    revision_dependency["enviroment"] = revision["environment"]
-                    record["revisions"][f"{revision["revision"]}"] = revision_dependency
-            record["kvms_proxy_scope"] = self.get_kvms_proxy(proxy["name"])
-            response.append(record)
-        print(f"Total proxy extracted: {len(response)}")
+                latest_revision = self.get_latest_revision_proxy(name)
+            revision_dependency = {}
+            revision_dependency["enviroment"] = ""
+            record["revisions"][f"{latest_revision}"] = revision_dependency
+        else:
+            dependencies = self.map(lambda revision: self.get_revision_dependency(name, revision), revisions)
+            for (revision, revision_dependency) in zip(revisions, dependencies):
+                record["revisions"][f"{revision["revision"]}"] = revision_dependency
+        record["kvms_proxy_scope"] = self.get_kvms_proxy(name)
+        if "revision" in proxy:
+            record["revision_list"] = proxy["revision"]
+        if "metaData" in proxy:
+            record["lastModifiedAt"] = proxy["metaData"].get("lastModifiedAt")
+        return record
+    def get_proxies(self,includeRevisions=False,includeMetaData=False,previous=None,bulk=False):
+        # previous is list of proxies from earlier snapshot, unchanged proxies are copied from it without any further request,
+        # with bulk deployments of all proxies are taken from organization listing instead of one request per proxy,
+        # every proxy is one task of worker pool, completed proxies are checkpointed and failed ones don't stop others
+        list_all_names_proxy = list(self.iterate_proxies(includeRevisions, includeMetaData))
+        index = None
+        if previous is not None or bulk:
+            index = self.get_deployments(environments=self.environments)
+        previous_proxies = {proxy["name"]: proxy for proxy in previous} if previous is not None else {}
+        reused = []
+        def extract(proxy):
+            revisions = index.get(proxy["name"], -1) if index is not None else self.get_deployed_revisions_proxy(proxy["name"])
+            if self.is_proxy_unchanged(previous_proxies.get(proxy["name"]), proxy, revisions):
+                reused.append(proxy["name"])
+                record = {key: value for key,value in previous_proxies[proxy["name"]].items() if key != "apiproduct"} # links are rebuilt later
+                record["kvms_proxy_scope"] = self.get_kvms_proxy(proxy["name"]) # creating proxy scoped kvm doesn't change lastModifiedAt
+                return record
+            return self.get_proxy(proxy, revisions)
+        # map keeps order of listing so output stays deterministic
+        records = self.map(lambda proxy: self.checkpoint.run("proxy", proxy["name"], lambda: extract(proxy), nested=False), list_all_names_proxy)
+        response = [record for record in records if record is not None]
+        print(f"Total proxy extracted: {len(response)} (reused from previous snapshot: {len(reused)}, failed: {len(records) - len(response)})")
+        print(f"Bundle cache: {self.cache.stats()}")
         print("proxy was done")
         return response
     def get_organization(self):
@@ -155,71 +244,137 @@ class ExtracterApigeeResources():
         kvms = []
         response = self.request.get(f"{self.main_url}{self.organization}/keyvaluemaps")
         for kvm in response.json():
-            record = {"name": kvm, "proxies": []}
+            record = {"name": kvm, "proxies": [], "sharedflow": []}
             kvms.append(record)
         return kvms
     def get_kvms_environment(self, environment):
         kvms = []
         response = self.request.get(f"{self.main_url}{self.organization}/environments/{environment}/keyvaluemaps")
         for kvm in response.json():
-            record = {"name": kvm, "proxies": []}
+            record = {"name": kvm, "proxies": [], "sharedflow": []}
             kvms.append(record)
         return kvms
     def get_kvms_proxy(self, proxy):
         response = self.request.get(f"{self.main_url}{self.organization}/apis/{proxy}/keyvaluemaps")
         return response.json()
-    def get_sharedflows_list(self):
-        sharedflows = []
-        response = self.request.get(f"{self.main_url}{self.organization}/sharedflows")
-        for sharedflow in response.json()['sharedFlows']:
-            record = {}
-            record["name"] = sharedflow["name"]
-            record["revisions"] = {}
-            record["proxy"] = []
-            revisions = self.get_sharedflow_deployments(sharedflow["name"])
-            for revision in revisions:
-                numberRevision = revision["revision"]
-                record["revisions"][f"{numberRevision}"] = {}
-                record["revisions"][f"{numberRevision}"]["environment"] = revision["environment"]
-                record["revisions"][f"{numberRevision}"]["proxy"] = [] 
-            sharedflows.append(record)
-        print(f"Total sharedflow extracted: {len(sharedflows)}")
+    def get_sharedflow(self, sharedflow, revisions):
+        # record of one sharedflow with dependencies of every deployed revision, sharedflow is item of listing
+        name = sharedflow["name"]
+        record = {}
+        record["name"] = name
+        record["revisions"] = {}
+        record["proxy"] = []
+        record["sharedflow"] = []
+        numbers = list(dict.fromkeys(f"{revision["revision"]}" for revision in revisions)) # revision deployed in several environments is scanned once
+        dependencies = dict(zip(numbers, self.map(lambda number: self.get_sharedflow_revision_dependency(name, number), numbers)))
+        for revision in revisions:
+            numberRevision = revision["revision"]
+            dependency = dependencies[f"{numberRevision}"]
+            record["revisions"][f"{numberRevision}"] = {}
+            record["revisions"][f"{numberRevision}"]["environment"] = revision["environment"]
+            record["revisions"][f"{numberRevision}"]["proxy"] = [] 
+            record["revisions"][f"{numberRevision}"]["kvms_dependency"] = dependency["kvms_dependency"]
+            record["revisions"][f"{numberRevision}"]["sharedflow"] = dependency["sharedflow"]
+            record["revisions"][f"{numberRevision}"]["cache_dependency"] = dependency["cache"]
+        if "revision" in sharedflow:
+            record["revision_list"] = sharedflow["revision"]
+        if "metaData" in sharedflow:
+            record["lastModifiedAt"] = sharedflow["metaData"].get("lastModifiedAt")
+        return record
+    def get_sharedflows_list(self, bulk=False, previous=None):
+        # with bulk deployments of all sharedflows are taken from organization listing,
+        # previous is list of sharedflows from earlier snapshot, unchanged ones are copied from it without scanning bundles again,
+        # every sharedflow with bundles of its deployed revisions is one checkpointed entity
+        response = self.request.get(f"{self.main_url}{self.organization}/sharedflows?includeRevisions=true&includeMetaData=true")
+        listing = response.json()['sharedFlows']
+        if bulk:
+            index = self.get_deployments(sharedflows=True, environments=self.environments)
+            deployments = lambda name: index.get(name, [])
+        else:
+            deployments = self.get_sharedflow_deployments
+        previous_sharedflows = {sharedflow["name"]: sharedflow for sharedflow in previous} if previous is not None else {}
+        reused = []
+        def extract(sharedflow):
+            revisions = deployments(sharedflow["name"])
+            if self.is_sharedflow_unchanged(previous_sharedflows.get(sharedflow["name"]), sharedflow, revisions):
+                reused.append(sharedflow["name"])
+                return dict(previous_sharedflows[sharedflow["name"]]) # links are rebuilt later
+            return self.get_sharedflow(sharedflow, revisions)
+        records = self.map(lambda sharedflow: self.checkpoint.run("sharedflow", sharedflow["name"], lambda: extract(sharedflow), nested=False), listing)
+        sharedflows = [record for record in records if record is not None] # failed ones are recorded in checkpoint
+        print(f"Total sharedflow extracted: {len(sharedflows)} (reused from previous snapshot: {len(reused)})")
         print("sharedflow was done")
         return sharedflows
     def get_sharedflow_deployments(self, sharedflowName):
-        response = self.request.get(f"{self.main_url}{self.organization}/sharedflows/{sharedflowName}/deployments")
-        if 'deployments' in response.json():
-            return response.json()['deployments']
+        response = self.request.get(f"{self.main_url}{self.organization}/sharedflows/{sharedflowName}/deployments").json()
+        if 'deployments' in response:
+            return response['deployments']
         else:
             return []
-    def get_apiproducts(self):
+    def format_apiproduct(self, apiproduct, details_apiproduct):
+        apiproduct["proxy"] = [] 
+        if "operationGroup" in details_apiproduct:
+            if "operationConfigs" in details_apiproduct["operationGroup"]:
+                details = details_apiproduct["operationGroup"]["operationConfigs"]
+                proxy = []
+                for detail in details:
+                    proxy.append(detail['apiSource'])
+                apiproduct["proxy"] = proxy
+        if "proxies" in details_apiproduct:
+            apiproduct["proxy"] = details_apiproduct["proxies"]
+        return apiproduct
+    def iterate_pages(self, url, collection, cursor, size_param="count"):
+        # generator over listing which follows Apigee startKey pagination page by page,
+        # every page starts with item given as startKey so it's skipped on all pages except first
+        start_key = None
+        separator = "&" if "?" in url else "?"
+        while True:
+            page_url = f"{url}{separator}{size_param}={self.page_size}"
+            if start_key is not None:
+                page_url += f"&startKey={quote(start_key, safe="")}"
+            response = self.request.get(page_url)
+            response.raise_for_status()
+            page = response.json().get(collection, [])
+            items = page[1:] if start_key is not None and len(page) > 0 and cursor(page[0]) == start_key else page
+            yield from items
+            if len(page) < self.page_size or len(items) == 0:
+                break
+            start_key = cursor(page[-1])
+    def iterate_proxies(self, includeRevisions=False, includeMetaData=False):
+        # proxies listing isn't paginated by Apigee, generator keeps same interface as other listings
+        response = self.request.get(f"{self.main_url}{self.organization}/apis?includeRevisions={str(includeRevisions).lower()}&includeMetaData={str(includeMetaData).lower()}")
+        yield from response.json().get("proxies", [])
+    def iterate_apiproducts(self, expand=False):
+        return self.iterate_pages(f"{self.main_url}{self.organization}/apiproducts?expand={str(expand).lower()}", "apiProduct", lambda apiproduct: apiproduct["name"])
+    def iterate_apps(self):
+        return self.iterate_pages(f"{self.main_url}{self.organization}/apps?expand=true", "app", lambda app: app["appId"], size_param="rows")
+    def iterate_developers(self):
+        return self.iterate_pages(f"{self.main_url}{self.organization}/developers?expand=true", "developer", lambda developer: developer["email"])
+    def get_apiproduct(self, name):
+        response = self.request.get(f"{self.main_url}{self.organization}/apiproducts/{name}")
+        response.raise_for_status()
+        return response.json()
+    def get_apiproducts(self, expand=False):
+        # with expand every product comes with its details, so no request per product is needed
         apiproducts = []
-        response = self.request.get(f"{self.main_url}{self.organization}/apiproducts")
-        apiproducts = response.json()['apiProduct']
-        for apiproduct in apiproducts:
-            apiproduct["proxy"] = [] 
-            details_apiproduct = self.request.get(f"{self.main_url}{self.organization}/apiproducts/{apiproduct["name"]}").json()
-            if "operationGroup" in details_apiproduct:
-                if "operationConfigs" in details_apiproduct["operationGroup"]:
-                    details = details_apiproduct["operationGroup"]["operationConfigs"]
-                    proxy = []
-                    for detail in details:
-                        proxy.append(detail['apiSource'])
-                    apiproduct["proxy"] = proxy
-            if "proxies" in details_apiproduct:
-                apiproduct["proxy"] = details_apiproduct["proxies"]
+        if expand:
+            for details in self.iterate_apiproducts(expand=True):
+                apiproducts.append(self.format_apiproduct({"name": details["name"]}, details))
+        else:
+            apiproducts = [{"name": apiproduct["name"]} for apiproduct in self.iterate_apiproducts()]
+            details = self.map(lambda apiproduct: self.checkpoint.run("apiproduct", apiproduct["name"], lambda: self.get_apiproduct(apiproduct["name"]), nested=False), apiproducts)
+            apiproducts = [self.format_apiproduct(apiproduct, details_apiproduct)
+                           for (apiproduct, details_apiproduct) in zip(apiproducts, details) if details_apiproduct is not None]
         print(f"Total apiproducts extracted: {len(apiproducts)}")
         print("apiproduct was done")
         return apiproducts
     def get_apps(self):
-        response = self.request.get(f"{self.main_url}{self.organization}/apps?expand=true")
-        apps = response.json()['app']
         new_format_apps = []
-        for app in apps:
+        for app in self.iterate_apps():
             record = {}
             record["name"] = app["name"]
             apiproducts = []
-            if 'apiProducts' in app["credentials"][0]:
+            if len(app.get("credentials", [])) > 0 and 'apiProducts' in app["credentials"][0]:
                 for apiproduct in app["credentials"][0]['apiProducts']:
                     apiproducts.append(apiproduct['apiproduct'])
             record["apiproduct"] = apiproducts
@@ -228,10 +383,8 @@ class ExtracterApigeeResources():
         print("apps was done")
         return new_format_apps
     def get_developers(self):
-        response = self.request.get(f"{self.main_url}{self.organization}/developers?expand=true")
-        developers = response.json()["developer"]
         new_format_developers = []
-        for developer in developers:
+        for developer in self.iterate_developers():
             record = {}
             record["email"] = developer["email"]
             apps = []
@@ -243,16 +396,23 @@ class ExtracterApigeeResources():
         print(f"Total developers extracted: {len(new_format_developers)}")
         print("Developers was done")
         return new_format_developers
-    def get_flowhooks(self, env):
+    def get_flowhooks(self, env, bulk=False):
+        # with bulk attached sharedflows are taken from deployed configuration of environment instead of request per flowhook
         response = self.request.get(f"{self.main_url}{self.organization}/environments/{env}/flowhooks").json()
         flowhooks = []
+        attached = None
+        if bulk:
+            config = self.request.get(f"{self.main_url}{self.organization}/environments/{env}/deployedConfig")
+            if config.ok:
+                attached = {flowhook["name"].split("/")[-1]: flowhook.get("sharedFlowName", "").split("/")[-1]
+                            for flowhook in config.json().get("flowhooks", [])}
+        if attached is None:
+            details = self.map(lambda flowhook: self.request.get(f"{self.main_url}{self.organization}/environments/{env}/flowhooks/{flowhook}").json(), response)
+            attached = {flowhook: response_flowhook.get("sharedFlow", "") for (flowhook, response_flowhook) in zip(response, details)}
         for flowhook in response:
             fh = {}
-            response_flowhook = self.request.get(f"{self.main_url}{self.organization}/environments/{env}/flowhooks/{flowhook}").json()
             fh["name"] = flowhook
-            fh["sharedflow"] = ""
-            if "sharedflow" in response_flowhook:
-                fh["sharedflow"] = response_flowhook["sharedFlow"] 
+            fh["sharedflow"] = attached.get(flowhook, "")
             flowhooks.append(fh)
         return flowhooks
     def get_keystores(self, env):
@@ -261,80 +421,135 @@ class ExtracterApigeeResources():
     def get_caches(self,env):
         response = self.request.get(f"{self.main_url}{self.organization}/environments/{env}/caches").json()
         return response
-    def build_hierarchy(self, file):
+    def get_environment(self, env):
+        return {"name": env, "kvm": self.get_kvms_environment(env),
+                "keystore": self.get_keystores(env), "cache": self.get_caches(env),
+                "flowhook": self.get_flowhooks(env, bulk=self.bulk), "proxy": [], "sharedflow": []}
+    def collect_metrics(self):
+        # counters kept by bundle cache, token manager and scheduler are copied into metrics before export
+        for (name, value) in self.cache.stats().items():
+            self.metrics.set(f"bundle_cache_{name}", value)
+        self.metrics.set("token_requests", getattr(self.request.aouth2, "refreshes", 0))
+        budgets = list(self.request.scheduler.stats().values())
+        self.metrics.set("throttled_responses", sum(budget["throttled"] for budget in budgets))
+        if len(budgets) > 0:
+            self.metrics.set("concurrency_limit", min(budget["concurrency"] for budget in budgets))
+        return self.metrics
+    def diff_hierarchy(self, previous, structure):
+        # compare entities of two snapshots by their key, fields filled by linking are ignored,
+        # entities which failed in this run are missing from structure but aren't reported as removed
+        failed = {(failure["kind"], failure["name"]) for failure in structure.get("failures", [])}
+        sections = {"organization_kvm": ("name", ["proxies", "sharedflow"]), "sharedflow": ("name", ["proxy", "sharedflow"]),
+                    "proxy": ("name", ["apiproduct"]), "apiproduct": ("name", ["app"]),
+                    "app": ("name", ["developer"]), "developers": ("email", [])}
+        changes = {}
+        for (section, (key, links)) in sections.items():
+            if ("section", section) in failed: # whole listing failed, nothing is known about this section
+                changes[section] = {"added": [], "removed": [], "changed": []}
+                continue
+            old = {record[key]: {k: v for k,v in record.items() if k not in links} for record in previous.get(section, [])
+                   if (section, record[key]) not in failed}
+            new = {record[key]: {k: v for k,v in record.items() if k not in links} for record in structure.get(section, [])}
+            changes[section] = {"added": [name for name in new if name not in old],
+                                "removed": [name for name in old if name not in new],
+                                "changed": [name for name in new if name in old and new[name] != old[name]]}
+        return changes
+    def build_hierarchy(self, file, previous=None, changes_file=None, format=None, compression=None):
+        # with previous (path to earlier hierarchy.json) only new and changed entities are fetched again,
+        # unchanged proxies are merged from previous snapshot and change report is written into changes_file,
+        # format and compression of output are taken from file extension unless given (see writer.py)
+        previous_structure = None
+        if previous is not None:
+            previous_structure = load_hierarchy(previous)
+            if previous_structure.get("organization_name") != self.organization:
+                raise ValueError(f"Snapshot {previous} belongs to organization {previous_structure.get("organization_name")}, not {self.organization}")
+        incremental = previous_structure is not None
+        bulk = self.bulk or incremental
         structure = {}
-        organization = self.get_organization()
-        structure["organization_name"] = organization["name"]
-        structure["organization_kvm"] = self.get_kvms_organization()
-        structure["environments"] = [{"name": env, "kvm": self.get_kvms_environment(env),
-                                      "keystore": self.get_keystores(env), "cache": self.get_caches(env),
-                                      "flowhook": self.get_flowhooks(env), "proxy": [], "sharedflow": []} 
-                                     for env in organization["environments"]]
-        structure["sharedflow"] = self.get_sharedflows_list()
-        structure["proxy"] = self.get_proxies()
-        structure["apiproduct"] = self.get_apiproducts()
-        structure["app"] = self.get_apps()
-        structure["developers"] = self.get_developers()
+        # every finished section (and every environment, proxy, ...) is checkpointed, --resume skips them
+        checkpoint = self.checkpoint
+        with self.metrics.phase("environments"):
+            organization = self.get_organization()
+            self.environments = organization["environments"]
+            structure["organization_name"] = organization["name"]
+            structure["organization_kvm"] = checkpoint.run("section", "organization_kvm", self.get_kvms_organization)
+            environments = self.map(lambda env: checkpoint.run("environment", env, lambda: self.get_environment(env), nested=False), organization["environments"])
+            structure["environments"] = [environment for environment in environments if environment is not None]
+        with self.metrics.phase("sharedflows"):
+            previous_sharedflows = previous_structure.get("sharedflow", []) if incremental else None
+            structure["sharedflow"] = checkpoint.run("section", "sharedflow", lambda: self.get_sharedflows_list(bulk=bulk, previous=previous_sharedflows))
+        with self.metrics.phase("proxies"):
+            structure["proxy"] = self.get_proxies(includeRevisions=True, includeMetaData=True,
+                                                  previous=previous_structure["proxy"] if incremental else None, bulk=bulk)
+        with self.metrics.phase("apiproducts"):
+            structure["apiproduct"] = checkpoint.run("section", "apiproduct", lambda: self.get_apiproducts(expand=bulk))
+        with self.metrics.phase("apps"):
+            structure["app"] = checkpoint.run("section", "app", self.get_apps)
+        with self.metrics.phase("developers"):
+            structure["developers"] = checkpoint.run("section", "developers", self.get_developers)
+        checkpoint.flush()
+        for section in ["organization_kvm", "sharedflow", "apiproduct", "app", "developers"]:
+            if structure[section] is None: # whole listing failed, hierarchy is saved without it
+                structure[section] = []
+        if len(checkpoint.failures) > 0:
+            structure["failures"] = checkpoint.failures
+            print(f"Failed entities: {len(checkpoint.failures)}, run again with --resume to retry only them")
+        changes = None
+        if incremental:
+            changes = self.diff_hierarchy(previous_structure, structure)
+            for (section, change) in changes.items():
+                print(f"{section}: added {len(change["added"])}, removed {len(change["removed"])}, changed {len(change["changed"])}")
+            if changes_file is not None:
+                with open(changes_file, "w", encoding="utf-8") as report:
+                    json.dump(changes, report, ensure_ascii=False, indent=4)
+                print(f"change report saved in file: {changes_file}")
         print("Start collecting dependencies...")
-        for kvm in structure["organization_kvm"]: # find dependency between kvms organization,environment scope and proxy
-            for proxy in structure["proxy"]:
-                for key,value in proxy["revisions"].items():
-                    if "kvms_dependency" in value:
-                        for KVM in value["kvms_dependency"]:
-                            if kvm["name"] == KVM:
-                                if proxy["name"] not in kvm["proxies"]:
-                                    kvm["proxies"].append(proxy["name"])
-        for record in structure["environments"]: # find dependency between kvms environment scope and proxy
-            for kvm in record["kvm"]:
-                for proxy in structure["proxy"]:
-                    for key,value in proxy["revisions"].items():
-                        if "kvms_dependency" in value:
-                            for KVM in value["kvms_dependency"]:
-                                if kvm["name"] == KVM:
-                                    if proxy["name"] not in kvm["proxies"]:
-                                        kvm["proxies"].append(proxy["name"])
-        for environment in structure["environments"]: # find dependency between environment and proxy
-            for proxy in structure["proxy"]:
-                for key,value in proxy["revisions"].items():
-                    if environment["name"] == value["enviroment"]:
-                        environment["proxy"].append(proxy["name"])
-        for environment in structure["environments"]: # find dependency between environment and sharedflow
-            for sharedflow in structure["sharedflow"]:
-                if len(sharedflow["revisions"]) > 0:
-                    for key,value in sharedflow["revisions"].items():
-                            if environment["name"] == value["environment"]:
-                                environment["sharedflow"].append(sharedflow["name"])
-        for proxy in structure["proxy"]: # find dependency between proxy and sharedflow
-            for key, value in proxy["revisions"].items():
-                if "sharedflow" in value:
-                    for sharedfl in value["sharedflow"]:
-                        for sharedflow in structure["sharedflow"]:
-                            if sharedfl == sharedflow["name"]:
-                                sharedflow["proxy"].append(proxy["name"])
-        for apiproduct in structure["apiproduct"]: # find dependency between apiproduct and proxy
-            for proxy in apiproduct["proxy"]:
-                for prox in structure["proxy"]:
-                    if prox["name"] == proxy:
-                       prox["apiproduct"] = apiproduct["name"]
-        for app in structure["app"]: # find dependency between app and apiproduct
-            for apiproduct in app['apiproduct']:
-                for apiprod in structure["apiproduct"]:
-                    if apiprod["name"] == apiproduct:
-                       apiprod["app"] = app["name"]
-        print("Almost done, are you still there?")
-        for developer in structure["developers"]: # find dependency between developers and app
-            for app in developer['app']:
-                for App in structure["app"]:
-                    if App["name"] == app:
-                       App["developer"] = developer["email"]
-        with open(file, "w", encoding="utf-8") as hierarchy:
-            json.dump(structure, hierarchy, ensure_ascii=False, indent=4)
+        with self.metrics.phase("dependency_linking"):
+            self.graph = DependencyGraph.from_hierarchy(structure) # kept for forward and reverse lookups after build
+            self.graph.apply(structure)
+        with self.metrics.phase("serialization"), HierarchyWriter(file, format or detect_format(file), compression or detect_compression(file)) as writer:
+            for (section, value) in structure.items():
+                writer.write_section(section, value)
         print(f"hierarchy saved in file: {file}")
+        print(f"Request scheduler: {self.request.scheduler.stats()}")
+        checkpoint.finish()
+        self.collect_metrics()
         return structure 
 if __name__ == "__main__":
+   parser = argparse.ArgumentParser(description="Extract hierarchy of Apigee organization resources")
+   parser.add_argument("--organization", default="gcp101027-apigeex")
+   parser.add_argument("--output", default="hierarchy.json")
+   parser.add_argument("--workers", type=int, default=1, help="number of concurrent requests (1 = serial crawl)")
+   parser.add_argument("--rate", type=float, help="max requests per second to management API (unlimited by default)")
+   parser.add_argument("--cache-dir", default=".bundle_cache", help="directory of parsed bundle cache")
+   parser.add_argument("--cache-size", type=int, default=256, help="max size of bundle cache in MB")
+   parser.add_argument("--no-cache", action="store_true", help="always download bundles, bypass bundle cache")
+   parser.add_argument("--bulk", action="store_true", help="fetch deployments, apiproducts and flowhooks with organization/environment level listings")
+   parser.add_argument("--page-size", type=int, default=1000, help="items per page of apps, developers and apiproducts listings")
+   parser.add_argument("--format", choices=FORMATS, help="output format, taken from extension of output file by default")
+   parser.add_argument("--compression", choices=["gzip", "zstd"], help="output compression, taken from extension (.gz, .zst) by default")
+   parser.add_argument("--metrics", help="save JSON report of requests, latency and phase timings into file")
+   parser.add_argument("--prometheus", help="save metrics in Prometheus text format into file")
+   parser.add_argument("--checkpoint", default=".checkpoint.sqlite", help="file of checkpoint with completed entities")
+   parser.add_argument("--resume", action="store_true", help="continue interrupted run, entities in checkpoint aren't fetched again")
+   parser.add_argument("--no-checkpoint", action="store_true", help="don't checkpoint completed entities")
+   parser.add_argument("--previous", help="earlier hierarchy.json, only changed entities are fetched again")
+   parser.add_argument("--changes", default="changes.json", help="file for change report of incremental run")
+   parser.add_argument("--store", help="also load hierarchy into indexed snapshot store for queries (see store.py)")
+   args = parser.parse_args()
    start = time.time()
-   extracter = ExtracterApigeeResources()
-   data1 = extracter.build_hierarchy("hierarchy.json")
+   cache = BundleCache(args.cache_dir, args.cache_size*1024*1024, enabled=not args.no_cache)
+   checkpoint = CheckpointStore(args.checkpoint, args.organization, enabled=not args.no_checkpoint, resume=args.resume)
+   extracter = ExtracterApigeeResources(organization=args.organization, workers=args.workers, cache=cache, bulk=args.bulk,
+                                        page_size=args.page_size, rate=args.rate, checkpoint=checkpoint)
+   data1 = extracter.build_hierarchy(args.output, previous=args.previous, changes_file=args.changes,
+                                      format=args.format, compression=args.compression)
+   extracter.metrics.save(args.metrics, args.prometheus)
+   if args.store is not None:
+       store = SnapshotStore(args.store)
+       store.load(data1, args.output)
+       store.close()
+       print(f"snapshot saved in store: {args.store}")
    end = time.time()
    print("Time to complete: %d", end-start)
 
@@ -0,0 +1,75 @@
+class DependencyGraph():
+    # many-to-many dependencies between resources of organization, node is (kind, name) tuple
+    # e.g. ("proxy", "orders-v1") -> ("sharedflow", "auth"), edges are kept in insertion order
+    def __init__(self):
+        self.forward = {} # node -> {dependency: None}
+        self.reverse = {} # dependency -> {dependent node: None}
+    def add_edge(self, source, target):
+        self.forward.setdefault(source, {})[target] = None
+        self.reverse.setdefault(target, {})[source] = None
+    def targets(self, source, kind=None):
+        # nodes which source depends on (proxy -> sharedflows, kvms, environments)
+        return [name for (node_kind, name) in self.forward.get(source, {}) if kind is None or node_kind == kind]
+    def sources(self, target, kind=None):
+        # nodes which depend on target (sharedflow -> proxies calling it)
+        return [name for (node_kind, name) in self.reverse.get(target, {}) if kind is None or node_kind == kind]
+    def edges(self):
+        for (source, targets) in self.forward.items():
+            for target in targets:
+                yield (source, target)
+    @classmethod
+    def from_hierarchy(cls, structure):
+        # single pass over every section of hierarchy, linear in number of references
+        graph = cls()
+        for proxy in structure.get("proxy", []):
+            for key,value in proxy["revisions"].items():
+                if value.get("enviroment", "") != "":
+                    graph.add_edge(("proxy", proxy["name"]), ("environment", value["enviroment"]))
+                for kvm in value.get("kvms_dependency", []):
+                    graph.add_edge(("proxy", proxy["name"]), ("kvm", kvm))
+                for sharedflow in value.get("sharedflow", []):
+                    graph.add_edge(("proxy", proxy["name"]), ("sharedflow", sharedflow))
+                for cache in value.get("cache_dependency", []):
+                    graph.add_edge(("proxy", proxy["name"]), ("cache", cache))
+        for sharedflow in structure.get("sharedflow", []):
+            for key,value in sharedflow["revisions"].items():
+                graph.add_edge(("sharedflow", sharedflow["name"]), ("environment", value["environment"]))
+                for kvm in value.get("kvms_dependency", []):
+                    graph.add_edge(("sharedflow", sharedflow["name"]), ("kvm", kvm))
+                for called in value.get("sharedflow", []):
+                    graph.add_edge(("sharedflow", sharedflow["name"]), ("sharedflow", called))
+                for cache in value.get("cache_dependency", []):
+                    graph.add_edge(("sharedflow", sharedflow["name"]), ("cache", cache))
+        for apiproduct in structure.get("apiproduct", []):
+            for proxy in apiproduct["proxy"]:
+                graph.add_edge(("apiproduct", apiproduct["name"]), ("proxy", proxy))
+        for app in structure.get("app", []):
+            for apiproduct in app["apiproduct"]:
+                graph.add_edge(("app", app["name"]), ("apiproduct", apiproduct))
+        for developer in structure.get("developers", []):
+            for app in developer["app"]:
+                graph.add_edge(("developer", developer["email"]), ("app", app))
+        return graph
+    def apply(self, structure):
+        # write reverse links back into hierarchy in its existing shape
+        for kvm in structure.get("organization_kvm", []):
+            kvm["proxies"] = self.sources(("kvm", kvm["name"]), "proxy")
+            kvm["sharedflow"] = self.sources(("kvm", kvm["name"]), "sharedflow")
+        for environment in structure.get("environments", []):
+            for kvm in environment["kvm"]:
+                kvm["proxies"] = self.sources(("kvm", kvm["name"]), "proxy")
+                kvm["sharedflow"] = self.sources(("kvm", kvm["name"]), "sharedflow")
+            environment["proxy"] = self.sources(("environment", environment["name"]), "proxy")
+            environment["sharedflow"] = self.sources(("environment", environment["name"]), "sharedflow")
+        for sharedflow in structure.get("sharedflow", []):
+            sharedflow["proxy"] = self.sources(("sharedflow", sharedflow["name"]), "proxy")
+            sharedflow["sharedflow"] = self.sources(("sharedflow", sharedflow["name"]), "sharedflow") # sharedflows calling this one
+        for proxy in structure.get("proxy", []):
+            proxy["apiproduct"] = self.sources(("proxy", proxy["name"]), "apiproduct")
+        for apiproduct in structure.get("apiproduct", []):
+            apiproduct["app"] = self.sources(("apiproduct", apiproduct["name"]), "app")
+        for app in structure.get("app", []):
+            developers = self.sources(("app", app["name"]), "developer")
+            if len(developers) > 0:
+                app["developer"] = developers[0]
+        return structure
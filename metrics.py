@@ -0,0 +1,126 @@
+import time
+import json
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60] # latency histogram bounds in seconds
+def endpoint_class(url):
+    # groups urls by endpoint, names of resources are replaced with * (e.g. apis/*/deployments, apis/*/revisions/* bundle),
+    # path below organization alternates collection and resource name
+    split = urlsplit(url)
+    parts = [part for part in split.path.split("/") if part]
+    if "organizations" in parts:
+        parts = parts[parts.index("organizations") + 2:]
+    else:
+        return split.path or "/"
+    if len(parts) == 0:
+        return "organization"
+    endpoint = "/".join(part if index % 2 == 0 else "*" for (index, part) in enumerate(parts))
+    if parse_qs(split.query).get("format") == ["bundle"]:
+        endpoint += " bundle"
+    return endpoint
+class Histogram():
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+    def observe(self, value):
+        for (index, bound) in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+class Metrics():
+    # counters, latency histograms and phase timings of one extraction run, safe to update from workers
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {} # (endpoint, status) -> count
+        self.latency = {} # endpoint -> Histogram
+        self.bytes = {} # endpoint -> bytes downloaded
+        self.retries = {} # endpoint -> count
+        self.counters = {} # other counters e.g. token_refreshes, bundle_cache_hits
+        self.phases = {} # phase -> seconds, repeated phases are summed
+        self.started = time.time()
+    def record_request(self, url, status, seconds, size=0):
+        endpoint = endpoint_class(url)
+        with self.lock:
+            self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+            self.latency.setdefault(endpoint, Histogram()).observe(seconds)
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+    def record_bytes(self, url, size):
+        endpoint = endpoint_class(url)
+        with self.lock:
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+    def record_retry(self, url):
+        endpoint = endpoint_class(url)
+        with self.lock:
+            self.retries[endpoint] = self.retries.get(endpoint, 0) + 1
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    def set(self, name, value):
+        with self.lock:
+            self.counters[name] = value
+    def add_phase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+    def report(self):
+        with self.lock:
+            endpoints = {}
+            for ((endpoint, status), count) in self.requests.items():
+                record = endpoints.setdefault(endpoint, {"requests": 0, "status": {}, "bytes": 0, "retries": 0})
+                record["requests"] += count
+                record["status"][str(status)] = count
+            for (endpoint, record) in endpoints.items():
+                histogram = self.latency[endpoint]
+                record["bytes"] = self.bytes.get(endpoint, 0)
+                record["retries"] = self.retries.get(endpoint, 0)
+                record["latency_seconds"] = {"sum": histogram.sum, "count": histogram.count,
+                                             "buckets": {str(bound): count for (bound, count) in zip(BUCKETS + ["+Inf"], histogram.counts)}}
+            return {"started": self.started, "duration": time.time() - self.started, "endpoints": endpoints,
+                    "counters": dict(self.counters), "phases": dict(self.phases)}
+    def prometheus(self, prefix="apigee_extracter"):
+        # Prometheus text exposition format, histogram buckets are cumulative
+        lines = []
+        with self.lock:
+            lines.append(f"# TYPE {prefix}_requests_total counter")
+            for ((endpoint, status), count) in sorted(self.requests.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+                lines.append(f'{prefix}_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+            lines.append(f"# TYPE {prefix}_request_duration_seconds histogram")
+            for (endpoint, histogram) in sorted(self.latency.items()):
+                cumulative = 0
+                for (bound, count) in zip(BUCKETS + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_request_duration_seconds_sum{{endpoint="{endpoint}"}} {histogram.sum}')
+                lines.append(f'{prefix}_request_duration_seconds_count{{endpoint="{endpoint}"}} {histogram.count}')
+            lines.append(f"# TYPE {prefix}_downloaded_bytes_total counter")
+            for (endpoint, size) in sorted(self.bytes.items()):
+                lines.append(f'{prefix}_downloaded_bytes_total{{endpoint="{endpoint}"}} {size}')
+            lines.append(f"# TYPE {prefix}_retries_total counter")
+            for (endpoint, count) in sorted(self.retries.items()):
+                lines.append(f'{prefix}_retries_total{{endpoint="{endpoint}"}} {count}')
+            for (name, value) in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                lines.append(f"{prefix}_{name} {value}")
+            lines.append(f"# TYPE {prefix}_phase_duration_seconds gauge")
+            for (name, seconds) in self.phases.items():
+                lines.append(f'{prefix}_phase_duration_seconds{{phase="{name}"}} {seconds}')
+        return "\n".join(lines) + "\n"
+    def save(self, json_file=None, prometheus_file=None):
+        if json_file is not None:
+            with open(json_file, "w", encoding="utf-8") as report:
+                json.dump(self.report(), report, indent=4)
+        if prometheus_file is not None:
+            with open(prometheus_file, "w", encoding="utf-8") as report:
+                report.write(self.prometheus())
@@ -0,0 +1,281 @@
+import io
+import json
+import time
+import random
+import zipfile
+import threading
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+class SyntheticOrganization():
+    # deterministic fake organization, same seed and counts always give same proxies, bundles and links
+    def __init__(self, name="mock-org", proxies=100, sharedflows=10, kvms=10, apiproducts=20,
+                 apps=50, developers=20, environments=2, bundle_size=0, seed=1):
+        self.name = name
+        rnd = random.Random(seed)
+        self.padding = rnd.randbytes(bundle_size) # resource of bundle_size bytes inside every bundle
+        self.environments = [f"env-{i}" for i in range(environments)]
+        self.kvms_organization = [f"org-kvm-{i}" for i in range(kvms)]
+        self.kvms_environment = {env: [f"{env}-kvm-{i}" for i in range(kvms)] for env in self.environments}
+        all_kvms = self.kvms_organization + [kvm for env in self.environments for kvm in self.kvms_environment[env]]
+        self.sharedflows = {}
+        for i in range(sharedflows):
+            name_sharedflow = f"sf-{i}"
+            revisions = list(range(1, rnd.randint(1, 3) + 1))
+            deployments = [(env, revisions[-1]) for env in self.environments if rnd.random() < 0.8]
+            nested = [f"sf-{j}" for j in range(i) if rnd.random() < 0.1]
+            self.sharedflows[name_sharedflow] = {"revisions": revisions, "deployments": deployments,
+                                                 "sharedflow": nested, "kvm": rnd.sample(all_kvms, min(1, len(all_kvms))),
+                                                 "lastModifiedAt": str(1700000000000 + i)}
+        self.proxies = {}
+        names_sharedflow = list(self.sharedflows)
+        for i in range(proxies):
+            name_proxy = f"proxy-{i}"
+            revisions = list(range(1, rnd.randint(1, 4) + 1))
+            deployments = []
+            for env in self.environments:
+                if rnd.random() < 0.7:
+                    deployments.append((env, rnd.choice(revisions)))
+            self.proxies[name_proxy] = {"revisions": revisions, "deployments": deployments,
+                                        "sharedflow": rnd.sample(names_sharedflow, min(len(names_sharedflow), rnd.randint(0, 3))),
+                                        "kvm": rnd.sample(all_kvms, min(len(all_kvms), rnd.randint(0, 2))),
+                                        "kvms_proxy_scope": [f"{name_proxy}-kvm"] if rnd.random() < 0.2 else [],
+                                        "lastModifiedAt": str(1700000000000 + i)}
+        names_proxy = list(self.proxies)
+        self.apiproducts = {}
+        for i in range(apiproducts):
+            self.apiproducts[f"product-{i}"] = {"proxies": rnd.sample(names_proxy, min(len(names_proxy), rnd.randint(1, 5))),
+                                                "operationGroup": rnd.random() < 0.5,
+                                                "lastModifiedAt": str(1700000000000 + i)}
+        names_product = list(self.apiproducts)
+        self.developers = {f"dev-{i}@example.com": [] for i in range(developers)}
+        emails = list(self.developers)
+        self.apps = {}
+        for i in range(apps):
+            email = rnd.choice(emails)
+            name_app = f"app-{i}"
+            self.apps[name_app] = {"appId": f"{i:08d}-app", "developer": email,
+                                   "apiproducts": rnd.sample(names_product, min(len(names_product), rnd.randint(0, 3))),
+                                   "lastModifiedAt": str(1700000000000 + i)}
+            self.developers[email].append(name_app)
+        self.flowhooks = {env: {"PreProxyFlowHook": rnd.choice(names_sharedflow) if names_sharedflow else None,
+                                "PostProxyFlowHook": None, "PreTargetFlowHook": None, "PostTargetFlowHook": None}
+                          for env in self.environments}
+    def bundle(self, prefix, sharedflows, kvms):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr(f"{prefix}/", "")
+            archive.writestr(f"{prefix}/policies/", "")
+            for sharedflow in sharedflows:
+                archive.writestr(f"{prefix}/policies/FC-{sharedflow}.xml",
+                                 f'<FlowCallout name="FC-{sharedflow}"><SharedFlowBundle>{sharedflow}</SharedFlowBundle></FlowCallout>')
+            for (i, kvm) in enumerate(kvms):
+                archive.writestr(f"{prefix}/policies/KVM-Get-{i}.xml",
+                                 f'<KeyValueMapOperations name="KVM-Get-{i}" mapIdentifier="{kvm}"><Scope>environment</Scope></KeyValueMapOperations>')
+            archive.writestr(f"{prefix}/policies/AM-Set.xml", '<AssignMessage name="AM-Set"><AssignTo/></AssignMessage>')
+            if len(self.padding) > 0:
+                archive.writestr(f"{prefix}/resources/jsc/padding.js", self.padding)
+        return buffer.getvalue()
+class MockApigeeHandler(BaseHTTPRequestHandler):
+    # implements endpoints of management API used by extracter plus /token of OAuth server
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    def log_message(self, format, *args):
+        pass
+    def send_payload(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for (key, value) in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(len(body))
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if urlsplit(self.path).path == "/token":
+            with self.server.lock:
+                self.server.tokens += 1
+            self.send_payload(200, {"access_token": f"mock-token-{self.server.tokens}", "expires_in": 3600, "token_type": "Bearer"})
+        else:
+            self.send_payload(404, {"error": "not found"})
+    def do_GET(self):
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+        if server.rate_limit > 0 and server.random.random() < server.rate_limit:
+            with server.lock:
+                server.throttled += 1
+            self.send_payload(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}, headers={"Retry-After": server.retry_after})
+            return
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self.send_payload(401, {"error": {"code": 401}})
+            return
+        split = urlsplit(self.path)
+        query = {key: value[0] for (key, value) in parse_qs(split.query).items()}
+        parts = [part for part in split.path.split("/") if part]
+        org = server.organization
+        if parts[:3] != ["v1", "organizations", org.name]:
+            self.send_payload(404, {"error": {"code": 404}})
+            return
+        status, body = self.route(org, parts[3:], query)
+        if isinstance(body, bytes):
+            self.send_payload(status, body, "application/octet-stream")
+        else:
+            self.send_payload(status, body)
+    def page(self, items, query, size_param, key):
+        # emulate Apigee startKey/count pagination where page starts at startKey item
+        if "startKey" in query:
+            keys = [key(item) for item in items]
+            items = items[keys.index(query["startKey"]):] if query["startKey"] in keys else []
+        if size_param in query:
+            items = items[:int(query[size_param])]
+        return items
+    def route(self, org, parts, query):
+        if not parts:
+            return 200, {"name": org.name, "environments": org.environments}
+        if parts == ["keyvaluemaps"]:
+            return 200, org.kvms_organization
+        if parts[0] == "environments" and len(parts) >= 3:
+            env = parts[1]
+            if env not in org.environments:
+                return 404, {"error": {"code": 404}}
+            if parts[2] == "keyvaluemaps":
+                return 200, org.kvms_environment[env]
+            if parts[2] == "keystores":
+                return 200, ["gateway"]
+            if parts[2] == "caches":
+                return 200, [f"{env}-cache"]
+            if parts[2] == "flowhooks" and len(parts) == 3:
+                return 200, list(org.flowhooks[env])
+            if parts[2] == "flowhooks":
+                sharedflow = org.flowhooks[env].get(parts[3])
+                return 200, ({"flowHookPoint": parts[3], "sharedFlow": sharedflow} if sharedflow else {"flowHookPoint": parts[3]})
+            if parts[2] == "deployments":
+                return 200, self.deployments(org, query, env)
+            if parts[2] == "deployedConfig":
+                return 200, {"name": f"organizations/{org.name}/environments/{env}/deployedConfig",
+                             "flowhooks": [{"name": f"organizations/{org.name}/environments/{env}/flowhooks/{point}",
+                                            "sharedFlowName": f"organizations/{org.name}/sharedflows/{sharedflow}", "continueOnError": True}
+                                           for (point, sharedflow) in org.flowhooks[env].items() if sharedflow]}
+        if parts == ["deployments"]:
+            return 200, self.deployments(org, query)
+        if parts[0] == "apis":
+            if len(parts) == 1:
+                proxies = []
+                for (name, proxy) in org.proxies.items():
+                    record = {"name": name}
+                    if query.get("includeRevisions", "false").lower() == "true":
+                        record["revision"] = [str(revision) for revision in proxy["revisions"]]
+                    if query.get("includeMetaData", "false").lower() == "true":
+                        record["metaData"] = {"createdAt": "1700000000000", "lastModifiedAt": proxy["lastModifiedAt"], "subType": "Proxy"}
+                    proxies.append(record)
+                return 200, {"proxies": proxies}
+            proxy = org.proxies.get(parts[1])
+            if proxy is None:
+                return 404, {"error": {"code": 404}}
+            if len(parts) == 2:
+                return 200, {"name": parts[1], "revision": [str(revision) for revision in proxy["revisions"]],
+                             "latestRevisionId": str(proxy["revisions"][-1])}
+            if parts[2] == "deployments":
+                if not proxy["deployments"]:
+                    return 200, {}
+                return 200, {"deployments": [{"environment": env, "apiProxy": parts[1], "revision": str(revision)} for (env, revision) in proxy["deployments"]]}
+            if parts[2] == "keyvaluemaps":
+                return 200, proxy["kvms_proxy_scope"]
+            if parts[2] == "revisions" and len(parts) == 4 and query.get("format") == "bundle":
+                return 200, org.bundle("apiproxy", proxy["sharedflow"], proxy["kvm"])
+        if parts[0] == "sharedflows":
+            if len(parts) == 1:
+                sharedflows = []
+                for (name, sharedflow) in org.sharedflows.items():
+                    record = {"name": name}
+                    if query.get("includeRevisions", "false").lower() == "true":
+                        record["revision"] = [str(revision) for revision in sharedflow["revisions"]]
+                    if query.get("includeMetaData", "false").lower() == "true":
+                        record["metaData"] = {"createdAt": "1700000000000", "lastModifiedAt": sharedflow["lastModifiedAt"]}
+                    sharedflows.append(record)
+                return 200, {"sharedFlows": sharedflows}
+            sharedflow = org.sharedflows.get(parts[1])
+            if sharedflow is None:
+                return 404, {"error": {"code": 404}}
+            if len(parts) == 3 and parts[2] == "deployments":
+                if not sharedflow["deployments"]:
+                    return 200, {}
+                return 200, {"deployments": [{"environment": env, "apiProxy": parts[1], "revision": str(revision)} for (env, revision) in sharedflow["deployments"]]}
+            if parts[2] == "revisions" and len(parts) == 4 and query.get("format") == "bundle":
+                return 200, org.bundle("sharedflowbundle", sharedflow["sharedflow"], sharedflow["kvm"])
+        if parts[0] == "apiproducts":
+            if len(parts) == 1:
+                names = self.page(list(org.apiproducts), query, "count", lambda name: name)
+                if query.get("expand", "false").lower() == "true":
+                    return 200, {"apiProduct": [self.apiproduct(org, name) for name in names]}
+                return 200, {"apiProduct": [{"name": name} for name in names]}
+            if parts[1] in org.apiproducts:
+                return 200, self.apiproduct(org, parts[1])
+        if parts == ["apps"]:
+            apps = self.page(list(org.apps.items()), query, "rows", lambda item: item[1]["appId"])
+            if query.get("expand", "false").lower() == "true":
+                return 200, {"app": [{"name": name, "appId": app["appId"], "developerId": app["developer"],
+                                      "lastModifiedAt": app["lastModifiedAt"],
+                                      "credentials": [{"consumerKey": app["appId"], "apiProducts": [{"apiproduct": product, "status": "approved"} for product in app["apiproducts"]]}]}
+                                     for (name, app) in apps]}
+            return 200, {"app": [{"appId": app["appId"]} for (name, app) in apps]}
+        if parts == ["developers"]:
+            developers = self.page(list(org.developers.items()), query, "count", lambda item: item[0])
+            return 200, {"developer": [{"email": email, "apps": apps, "lastModifiedAt": "1700000000000"} for (email, apps) in developers]}
+        return 404, {"error": {"code": 404}}
+    def apiproduct(self, org, name):
+        apiproduct = org.apiproducts[name]
+        record = {"name": name, "lastModifiedAt": apiproduct["lastModifiedAt"]}
+        if apiproduct["operationGroup"]:
+            record["operationGroup"] = {"operationConfigs": [{"apiSource": proxy} for proxy in apiproduct["proxies"]]}
+        else:
+            record["proxies"] = apiproduct["proxies"]
+        return record
+    def deployments(self, org, query, environment=None):
+        entities = org.sharedflows if query.get("sharedFlows", "false").lower() == "true" else org.proxies
+        deployments = [{"environment": env, "apiProxy": name, "revision": str(revision)}
+                       for (name, entity) in entities.items() for (env, revision) in entity["deployments"]
+                       if environment is None or env == environment]
+        return {"deployments": deployments}
+class MockApigeeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    def __init__(self, organization, address=("127.0.0.1", 0), latency=0.0, rate_limit=0.0, seed=1):
+        super().__init__(address, MockApigeeHandler)
+        self.organization = organization
+        self.latency = latency # seconds added to every GET
+        self.rate_limit = rate_limit # share of GET requests answered with 429
+        self.retry_after = "0" # Retry-After header of 429 responses
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.throttled = 0
+        self.tokens = 0
+    def record(self, size):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += size
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for Apigee management API")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--proxies", type=int, default=100)
+    parser.add_argument("--bundle-size", type=int, default=0, help="bytes of padding in every bundle")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with 429")
+    args = parser.parse_args()
+    organization = SyntheticOrganization(proxies=args.proxies, bundle_size=args.bundle_size)
+    server = MockApigeeServer(organization, ("127.0.0.1", args.port), args.latency, args.rate_limit)
+    print(f"Mock Apigee API listening on {server.url}")
+    server.serve_forever()
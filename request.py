@@ -1,22 +1,92 @@
 import requests
+import time
+import random
+import email.utils
+from requests.adapters import HTTPAdapter
 from auth2 import Auth2Token
+from scheduler import RequestScheduler, PRIORITY_LIST, PRIORITY_BUNDLE
+from metrics import Metrics
+# connection failures worth retrying, reset while reading body surfaces as ChunkedEncodingError
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
 class RestRequest():
-    def __init__(self):
-        self.aouth2 = Auth2Token("key.pem")
-        self.aouth2.generate_new_access_token()
+    def __init__(self, pool_size=10, timeout=(10, 120), max_retries=5, backoff_factor=0.5, backoff_max=60, aouth2=None,
+                 scheduler=None, metrics=None):
+        self.aouth2 = aouth2 if aouth2 is not None else Auth2Token("key.pem") # token manager shared by all workers
+        self.timeout = timeout # (connect, read) timeout in seconds
+        self.metrics = metrics if metrics is not None else Metrics() # per endpoint counters and latency
+        self.max_retries = max_retries # retries for 429/5xx responses and connection resets
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.retry_status = [429, 500, 502, 503, 504]
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler(max_concurrency=pool_size) # rate limit and AIMD concurrency
+        self.session = requests.Session() # shared pool of keep-alive connections
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.access_token = self.aouth2.get_access_token()
         self.headers = {"Authorization": "Bearer "+ self.access_token}
-    def updateCrediatianals(self):
-        self.aouth2.generate_new_access_token()
+    def updateCrediatianals(self, failed_token=None):
+        # only one worker refreshes token, others which failed with the same token reuse the new one,
+        # real refreshes are counted by token manager (see collect_metrics)
+        self.metrics.increment("token_401_responses")
+        self.aouth2.generate_new_access_token(failed_token)
         self.access_token = self.aouth2.get_access_token()
         self.headers = {"Authorization": "Bearer "+ self.access_token}
-    def get(self, url, stream=False):
-        retry = 0
-        response = requests.get(url,headers=self.headers,stream=stream)
-        while response.status_code == 401:
-            self.updateCrediatianals()
-            response = requests.get(url,headers=self.headers)
-            retry +=1
-            if retry == 3:
-                break
-        return response
\ No newline at end of file
+    def backoff(self, attempt):
+        # exponential backoff with full jitter
+        time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt))))
+    def retry_after(self, response):
+        # Retry-After is either number of seconds or HTTP date
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            try:
+                return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+    def get(self, url, stream=False, priority=None):
+        # bundle downloads get lower priority than listings unless priority is given
+        if priority is None:
+            priority = PRIORITY_BUNDLE if "format=bundle" in url else PRIORITY_LIST
+        refresh = 0
+        attempt = 0
+        while True:
+            access_token = self.aouth2.get_access_token() # refreshed in advance shortly before expiry
+            key = self.scheduler.acquire(url, priority)
+            start = time.perf_counter()
+            response = None
+            retry_after = None
+            try:
+                response = self.session.get(url,headers={"Authorization": "Bearer "+ access_token},stream=stream,timeout=self.timeout)
+                if response.status_code in self.retry_status:
+                    retry_after = self.retry_after(response)
+            except RETRY_ERRORS:
+                self.metrics.record_request(url, "error", time.perf_counter() - start)
+                if attempt == self.max_retries:
+                    raise
+            finally:
+                # slot is given back whatever was raised, status None only frees it
+                self.scheduler.release(key, response.status_code if response is not None else None, retry_after)
+            if response is None:
+                self.metrics.record_retry(url)
+                self.backoff(attempt)
+                attempt += 1
+                continue
+            # streamed body is counted by its reader, other bodies are already downloaded here
+            self.metrics.record_request(url, response.status_code, time.perf_counter() - start, 0 if stream else len(response.content))
+            if response.status_code == 401 and refresh < 3:
+                response.close()
+                self.updateCrediatianals(access_token)
+                refresh += 1
+                continue
+            if response.status_code in self.retry_status and attempt < self.max_retries:
+                response.close()
+                self.metrics.record_retry(url)
+                if retry_after is None:
+                    self.backoff(attempt) # with Retry-After scheduler holds requests to this host until it passes
+                attempt += 1
+                continue
+            return response
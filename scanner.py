@@ -0,0 +1,50 @@
+import re
+import xml.etree.ElementTree as ET
+POLICY_FILE = re.compile(r"^(apiproxy|sharedflowbundle)/policies/([^/]+\.xml)$")
+CACHE_POLICIES = {"PopulateCache", "LookupCache", "InvalidateCache", "ResponseCache"}
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1] # drop namespace if policy has one
+def scan_policy(stream):
+    # identifies policy by its root element and reads only as far as needed:
+    # KeyValueMapOperations stops at root (mapIdentifier attribute), policies without references stop at root too,
+    # FlowCallout and cache policies are read until their reference elements
+    references = {"type": None, "sharedflow": [], "kvm": [], "cache": []}
+    for (event, element) in ET.iterparse(stream, events=("start", "end")):
+        tag = local_name(element.tag)
+        if references["type"] is None:
+            references["type"] = tag
+            if tag == "KeyValueMapOperations":
+                if element.get("mapIdentifier") is not None:
+                    references["kvm"].append(element.get("mapIdentifier"))
+                break
+            if tag != "FlowCallout" and tag not in CACHE_POLICIES:
+                break
+            continue
+        if event != "end":
+            continue
+        if tag == "SharedFlowBundle" and references["type"] == "FlowCallout" and element.text:
+            references["sharedflow"].append(element.text.strip())
+        elif tag == "CacheResource" and element.text:
+            references["cache"].append(element.text.strip())
+        element.clear()
+    return references
+def scan_bundle(archive):
+    # single pass over every policy of proxy or sharedflow bundle (zipfile.ZipFile),
+    # returns references in order of policies without duplicates
+    result = {"sharedflow": [], "kvm": [], "cache": [], "policies": [], "errors": []}
+    for name in archive.namelist():
+        match = POLICY_FILE.match(name)
+        if match is None:
+            continue
+        result["policies"].append(match.group(2))
+        try:
+            with archive.open(name) as policy:
+                references = scan_policy(policy)
+        except ET.ParseError as error:
+            result["errors"].append(f"{match.group(2)}: {error}")
+            continue
+        for kind in ["sharedflow", "kvm", "cache"]:
+            for reference in references[kind]:
+                if reference not in result[kind]:
+                    result[kind].append(reference)
+    return result
@@ -0,0 +1,95 @@
+import time
+import heapq
+import itertools
+import threading
+from urllib.parse import urlsplit
+PRIORITY_LIST = 0 # cheap listing and detail calls go first
+PRIORITY_BUNDLE = 1 # revision bundle downloads wait while listings are queued
+class HostBudget():
+    def __init__(self, rate, burst, concurrency):
+        self.rate = rate # requests per second, None means no request budget
+        self.burst = burst
+        self.tokens = burst
+        self.refilled = time.monotonic()
+        self.limit = concurrency # current AIMD concurrency limit, float so it can grow by fractions
+        self.in_flight = 0
+        self.blocked_until = 0 # set from Retry-After or throttling
+        self.decreased = 0
+        self.waiters = [] # heap of (priority, sequence)
+        self.throttled = 0
+        self.completed = 0
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+class RequestScheduler():
+    # gate in front of transport: token bucket request budget and AIMD concurrency limit per host/organization,
+    # waiting requests are served by priority so listings are not stuck behind bundle downloads
+    def __init__(self, rate=None, burst=None, max_concurrency=10, min_concurrency=1,
+                 increase=1.0, decrease=0.5, cooldown=1.0):
+        self.rate = rate
+        self.burst = burst if burst is not None else (max(1, rate) if rate is not None else 1)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.increase = increase # concurrency added per limit of healthy responses (additive increase)
+        self.decrease = decrease # concurrency multiplier on 429/503 (multiplicative decrease)
+        self.cooldown = cooldown # seconds between two decreases, one burst of 429 counts once
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.hosts = {}
+    def key(self, url):
+        split = urlsplit(url)
+        parts = split.path.split("/")
+        if "organizations" in parts and parts.index("organizations") + 1 < len(parts):
+            return f"{split.netloc}/{parts[parts.index("organizations") + 1]}"
+        return split.netloc
+    def budget(self, key):
+        if key not in self.hosts:
+            self.hosts[key] = HostBudget(self.rate, self.burst, self.max_concurrency)
+        return self.hosts[key]
+    def acquire(self, url, priority=PRIORITY_LIST):
+        key = self.key(url)
+        with self.condition:
+            budget = self.budget(key)
+            entry = (priority, next(self.sequence))
+            heapq.heappush(budget.waiters, entry)
+            while True:
+                now = time.monotonic()
+                budget.refill(now)
+                ready = budget.waiters[0] == entry and budget.in_flight < int(budget.limit) and now >= budget.blocked_until
+                if ready and (budget.rate is None or budget.tokens >= 1):
+                    heapq.heappop(budget.waiters)
+                    if budget.rate is not None:
+                        budget.tokens -= 1
+                    budget.in_flight += 1
+                    self.condition.notify_all()
+                    return key
+                if now < budget.blocked_until:
+                    timeout = budget.blocked_until - now
+                elif ready:
+                    timeout = (1 - budget.tokens) / budget.rate
+                else:
+                    timeout = None # woken up by release of other request
+                self.condition.wait(timeout)
+    def release(self, key, status=None, retry_after=None):
+        # status None means connection error, it only frees the slot,
+        # retry_after (given for every retried status, not only 429/503) holds requests to this host until it passes
+        with self.condition:
+            budget = self.budget(key)
+            budget.in_flight -= 1
+            now = time.monotonic()
+            if retry_after is not None:
+                budget.blocked_until = max(budget.blocked_until, now + retry_after)
+            if status in (429, 503):
+                budget.throttled += 1
+                if now - budget.decreased >= self.cooldown:
+                    budget.limit = max(self.min_concurrency, budget.limit * self.decrease)
+                    budget.decreased = now
+            elif status is not None and status < 500:
+                budget.completed += 1
+                budget.limit = min(self.max_concurrency, budget.limit + self.increase / max(1, budget.limit))
+            self.condition.notify_all()
+    def stats(self):
+        with self.condition:
+            return {key: {"concurrency": round(budget.limit, 2), "throttled": budget.throttled, "completed": budget.completed}
+                    for (key, budget) in self.hosts.items()}
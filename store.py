@@ -0,0 +1,195 @@
+import json
+import time
+import sqlite3
+import argparse
+from graph import DependencyGraph
+from writer import load_hierarchy
+ENTITIES = {"environment": "name TEXT PRIMARY KEY",
+            "kvm": "name TEXT, scope TEXT, owner TEXT, PRIMARY KEY (name, scope, owner)", # scope organization/environment/proxy, owner is environment or proxy
+            "cache": "name TEXT, environment TEXT, PRIMARY KEY (name, environment)",
+            "keystore": "name TEXT, environment TEXT, PRIMARY KEY (name, environment)",
+            "flowhook": "environment TEXT, name TEXT, sharedflow TEXT, PRIMARY KEY (environment, name)",
+            "sharedflow": "name TEXT PRIMARY KEY",
+            "proxy": "name TEXT PRIMARY KEY, last_modified_at TEXT, revisions INTEGER",
+            "apiproduct": "name TEXT PRIMARY KEY",
+            "app": "name TEXT, developer TEXT, PRIMARY KEY (name, developer)",
+            "developer": "email TEXT PRIMARY KEY",
+            "failure": "kind TEXT, name TEXT, error TEXT"}
+# edge table is named source_target after node kinds of DependencyGraph, e.g. proxy_sharedflow (proxy calls sharedflow)
+EDGES = ["proxy_environment", "proxy_kvm", "proxy_sharedflow", "proxy_cache",
+         "sharedflow_environment", "sharedflow_kvm", "sharedflow_sharedflow", "sharedflow_cache",
+         "apiproduct_proxy", "app_apiproduct", "developer_app"]
+INDEXES = ["CREATE INDEX IF NOT EXISTS kvm_name ON kvm (name)",
+           "CREATE INDEX IF NOT EXISTS cache_name ON cache (name)",
+           "CREATE INDEX IF NOT EXISTS flowhook_sharedflow ON flowhook (sharedflow)"]
+ORPHANS = {"unused_kvms": ("kvms of organization and environments which no proxy or sharedflow reads",
+                           "SELECT scope, owner, name FROM kvm WHERE scope != 'proxy' "
+                           "AND name NOT IN (SELECT target FROM proxy_kvm) AND name NOT IN (SELECT target FROM sharedflow_kvm) ORDER BY scope, owner, name"),
+           "unused_caches": ("caches which no proxy or sharedflow policy uses",
+                             "SELECT environment, name FROM cache "
+                             "WHERE name NOT IN (SELECT target FROM proxy_cache) AND name NOT IN (SELECT target FROM sharedflow_cache) ORDER BY environment, name"),
+           "unused_sharedflows": ("sharedflows not called by any proxy or sharedflow and not attached to flowhook",
+                                  "SELECT name FROM sharedflow WHERE name NOT IN (SELECT target FROM proxy_sharedflow) "
+                                  "AND name NOT IN (SELECT target FROM sharedflow_sharedflow) AND name NOT IN (SELECT sharedflow FROM flowhook) ORDER BY name"),
+           "undeployed_sharedflows": ("sharedflows deployed in no environment",
+                                      "SELECT name FROM sharedflow WHERE name NOT IN (SELECT source FROM sharedflow_environment) ORDER BY name"),
+           "undeployed_proxies": ("proxies deployed in no environment",
+                                  "SELECT name FROM proxy WHERE name NOT IN (SELECT source FROM proxy_environment) ORDER BY name"),
+           "unproducted_proxies": ("proxies which are not part of any apiproduct",
+                                   "SELECT name FROM proxy WHERE name NOT IN (SELECT target FROM apiproduct_proxy) ORDER BY name"),
+           "undeployed_unproducted_proxies": ("proxies neither deployed nor part of any apiproduct",
+                                              "SELECT name FROM proxy WHERE name NOT IN (SELECT source FROM proxy_environment) "
+                                              "AND name NOT IN (SELECT target FROM apiproduct_proxy) ORDER BY name"),
+           "products_without_apps": ("apiproducts which no app subscribes",
+                                     "SELECT name FROM apiproduct WHERE name NOT IN (SELECT target FROM app_apiproduct) ORDER BY name"),
+           "products_without_proxies": ("apiproducts without any proxy",
+                                        "SELECT name FROM apiproduct WHERE name NOT IN (SELECT source FROM apiproduct_proxy) ORDER BY name"),
+           "apps_without_products": ("apps without any apiproduct",
+                                     "SELECT name, developer FROM app WHERE name NOT IN (SELECT source FROM app_apiproduct) ORDER BY name"),
+           "developers_without_apps": ("developers without any app",
+                                       "SELECT email FROM developer WHERE email NOT IN (SELECT source FROM developer_app) ORDER BY email")}
+# resource kind -> edge tables of resources which stop working when it's deleted
+DEPENDENTS = {"kvm": ["proxy_kvm", "sharedflow_kvm"], "cache": ["proxy_cache", "sharedflow_cache"],
+              "sharedflow": ["proxy_sharedflow", "sharedflow_sharedflow"], "proxy": ["apiproduct_proxy"],
+              "apiproduct": ["app_apiproduct"], "app": []}
+KEYS = {"kvm": "name", "cache": "name", "sharedflow": "name", "proxy": "name", "apiproduct": "name", "app": "name"}
+class SnapshotStore():
+    # indexed copy of last extracted hierarchy, orphan and impact questions are answered from it without API calls,
+    # every load replaces previous snapshot
+    def __init__(self, path="hierarchy.sqlite"):
+        self.path = path
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS snapshot (organization TEXT, source TEXT, loaded_at REAL)")
+        for (table, columns) in ENTITIES.items():
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+        for table in EDGES:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (source TEXT, target TEXT, PRIMARY KEY (source, target))")
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_target ON {table} (target)")
+        for index in INDEXES:
+            self.connection.execute(index)
+        self.connection.commit()
+    def load(self, structure, source=""):
+        # whole snapshot is written in one transaction, readers never see half loaded store
+        graph = DependencyGraph.from_hierarchy(structure)
+        rows = {table: [] for table in list(ENTITIES) + EDGES}
+        for kvm in structure.get("organization_kvm", []):
+            rows["kvm"].append((kvm["name"], "organization", ""))
+        for environment in structure.get("environments", []):
+            rows["environment"].append((environment["name"],))
+            rows["kvm"] += [(kvm["name"], "environment", environment["name"]) for kvm in environment.get("kvm", [])]
+            rows["cache"] += [(cache, environment["name"]) for cache in environment.get("cache", [])]
+            rows["keystore"] += [(keystore, environment["name"]) for keystore in environment.get("keystore", [])]
+            rows["flowhook"] += [(environment["name"], flowhook["name"], flowhook["sharedflow"]) for flowhook in environment.get("flowhook", [])
+                                 if flowhook["sharedflow"] != ""]
+        for sharedflow in structure.get("sharedflow", []):
+            rows["sharedflow"].append((sharedflow["name"],))
+        for proxy in structure.get("proxy", []):
+            rows["proxy"].append((proxy["name"], proxy.get("lastModifiedAt"), len(proxy.get("revision_list", proxy["revisions"]))))
+            rows["kvm"] += [(kvm, "proxy", proxy["name"]) for kvm in proxy.get("kvms_proxy_scope", [])]
+        rows["apiproduct"] = [(apiproduct["name"],) for apiproduct in structure.get("apiproduct", [])]
+        rows["app"] = [(app["name"], app.get("developer", "")) for app in structure.get("app", [])]
+        rows["developer"] = [(developer["email"],) for developer in structure.get("developers", [])]
+        rows["failure"] = [(failure["kind"], failure["name"], failure["error"]) for failure in structure.get("failures", [])]
+        for ((source_kind, dependent), (target_kind, dependency)) in graph.edges():
+            table = f"{source_kind}_{target_kind}"
+            if table in rows:
+                rows[table].append((dependent, dependency))
+        with self.connection:
+            self.connection.execute("DELETE FROM snapshot")
+            self.connection.execute("INSERT INTO snapshot VALUES (?, ?, ?)", (structure.get("organization_name"), source, time.time()))
+            for (table, values) in rows.items():
+                self.connection.execute(f"DELETE FROM {table}")
+                if len(values) > 0:
+                    placeholders = ", ".join("?" * len(values[0]))
+                    self.connection.executemany(f"INSERT OR IGNORE INTO {table} VALUES ({placeholders})", values)
+        return {table: len(values) for (table, values) in rows.items()}
+    def snapshot(self):
+        row = self.connection.execute("SELECT organization, source, loaded_at FROM snapshot").fetchone()
+        if row is None:
+            return None
+        failures = self.connection.execute("SELECT COUNT(*) FROM failure").fetchone()[0]
+        return {"organization": row[0], "source": row[1], "loaded_at": row[2], "failures": failures}
+    def orphans(self, names=None):
+        result = {}
+        for name in names or ORPHANS:
+            cursor = self.connection.execute(ORPHANS[name][1])
+            columns = [column[0] for column in cursor.description]
+            result[name] = [dict(zip(columns, row)) for row in cursor]
+        return result
+    def contains(self, kind, name):
+        return self.connection.execute(f"SELECT 1 FROM {kind} WHERE {KEYS[kind]}=? LIMIT 1", (name,)).fetchone() is not None
+    def impact(self, kind, name):
+        # transitive dependents of resource breadth first: sharedflow -> proxies and sharedflows calling it -> apiproducts -> apps,
+        # flowhooks attaching deleted sharedflow are reported too, every resource is listed once with the resource it breaks through
+        impacted = []
+        seen = {(kind, name)}
+        queue = [(kind, name, 0)]
+        while len(queue) > 0:
+            (target_kind, target, depth) = queue.pop(0)
+            if target_kind == "sharedflow":
+                for (environment, flowhook) in self.connection.execute("SELECT environment, name FROM flowhook WHERE sharedflow=? ORDER BY environment, name", (target,)):
+                    impacted.append({"kind": "flowhook", "name": f"{environment}/{flowhook}", "via": f"sharedflow {target}", "depth": depth + 1})
+            for table in DEPENDENTS[target_kind]:
+                source_kind = table.split("_")[0]
+                for (source,) in self.connection.execute(f"SELECT source FROM {table} WHERE target=? ORDER BY source", (target,)):
+                    if (source_kind, source) in seen:
+                        continue
+                    seen.add((source_kind, source))
+                    impacted.append({"kind": source_kind, "name": source, "via": f"{target_kind} {target}", "depth": depth + 1})
+                    queue.append((source_kind, source, depth + 1))
+        return impacted
+    def close(self):
+        self.connection.close()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query indexed snapshot of Apigee organization hierarchy")
+    parser.add_argument("--store", default="hierarchy.sqlite", help="file of snapshot store")
+    parser.add_argument("--json", action="store_true", help="print result as JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("load", help="replace snapshot with hierarchy file (any format written by extracter)")
+    load.add_argument("hierarchy")
+    commands.add_parser("info", help="show organization and source of snapshot")
+    orphans = commands.add_parser("orphans", help="unused and unreachable resources")
+    orphans.add_argument("query", nargs="*", help=f"orphan queries to run, all by default: {", ".join(ORPHANS)}")
+    impact = commands.add_parser("impact", help="what breaks when resource is deleted")
+    impact.add_argument("kind", choices=list(DEPENDENTS))
+    impact.add_argument("name")
+    args = parser.parse_args()
+    if args.command == "orphans" and any(query not in ORPHANS for query in args.query):
+        parser.error(f"unknown orphan query, choose from: {", ".join(ORPHANS)}")
+    store = SnapshotStore(args.store)
+    start = time.perf_counter()
+    if args.command == "load":
+        counts = store.load(load_hierarchy(args.hierarchy), args.hierarchy)
+        print(f"snapshot of {args.hierarchy} loaded into {args.store}: " + ", ".join(f"{table} {count}" for (table, count) in counts.items() if count > 0))
+    elif args.command == "info":
+        snapshot = store.snapshot()
+        if snapshot is None:
+            print(f"Store {args.store} is empty, run load first")
+        elif args.json:
+            print(json.dumps(snapshot, indent=4))
+        else:
+            print(f"organization {snapshot["organization"]} from {snapshot["source"]} loaded at {time.ctime(snapshot["loaded_at"])}, failed entities {snapshot["failures"]}")
+    elif args.command == "orphans":
+        result = store.orphans(args.query)
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False, indent=4))
+        else:
+            for (name, rows) in result.items():
+                print(f"{name} ({ORPHANS[name][0]}): {len(rows)}")
+                for row in rows:
+                    print("    " + " ".join(str(value) for value in row.values() if value != ""))
+    elif args.command == "impact":
+        if not store.contains(args.kind, args.name):
+            print(f"{args.kind} {args.name} isn't in snapshot")
+        result = store.impact(args.kind, args.name)
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False, indent=4))
+        else:
+            print(f"Deleting {args.kind} {args.name} breaks {len(result)} resources")
+            for record in result:
+                print(f"{"    " * record["depth"]}{record["kind"]} {record["name"]} (via {record["via"]})")
+    snapshot = store.snapshot()
+    if snapshot is not None and snapshot["failures"] > 0 and args.command != "load":
+        print(f"Warning: snapshot is incomplete, {snapshot["failures"]} entities failed during extraction")
+    print(f"answered in {(time.perf_counter() - start) * 1000:.1f} ms")
+    store.close()
@@ -0,0 +1,121 @@
+import io
+import gzip
+import json
+try:
+    import zstandard # optional, needed only for zstd compression
+except ImportError:
+    zstandard = None
+FORMATS = ["json", "minified", "ndjson"]
+COMPRESSIONS = [None, "gzip", "zstd"]
+def detect_compression(file):
+    if str(file).endswith(".gz"):
+        return "gzip"
+    if str(file).endswith(".zst"):
+        return "zstd"
+    return None
+def detect_format(file):
+    name = str(file).removesuffix(".gz").removesuffix(".zst")
+    if name.endswith(".ndjson") or name.endswith(".jsonl"):
+        return "ndjson"
+    return "json"
+def open_text(file, mode, compression):
+    # mode is "r" or "w", returns text stream which (de)compresses on the fly
+    if compression is None:
+        return open(file, mode, encoding="utf-8")
+    if compression == "gzip":
+        return gzip.open(file, mode+"t", encoding="utf-8")
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires zstandard package (pip install zstandard)")
+        raw = open(file, mode+"b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    raise ValueError(f"Unknown compression {compression}, expected one of {COMPRESSIONS}")
+class HierarchyWriter():
+    # writes hierarchy section by section and entity by entity, so no serialized copy of whole structure is built
+    # json is same pretty printed layout as json.dump(indent=4), minified is json without whitespace,
+    # ndjson is one line per entity: {"section":"proxy","data":{...}}, list sections start with {"section":"proxy","list":true}
+    def __init__(self, file, format="json", compression=None):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format {format}, expected one of {FORMATS}")
+        self.file = file
+        self.format = format
+        self.stream = open_text(file, "w", compression)
+        self.sections = 0
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    def encode(self, value):
+        if self.format == "json":
+            return json.dumps(value, ensure_ascii=False, indent=4)
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    def write_section(self, name, value):
+        if self.format == "ndjson":
+            entities = value if isinstance(value, list) else [value]
+            if isinstance(value, list):
+                self.stream.write(json.dumps({"section": name, "list": True}, ensure_ascii=False, separators=(",", ":")))
+                self.stream.write("\n")
+            for entity in entities:
+                self.stream.write(json.dumps({"section": name, "data": entity}, ensure_ascii=False, separators=(",", ":")))
+                self.stream.write("\n")
+            self.sections += 1
+            return
+        pretty = self.format == "json"
+        self.stream.write(("{" if self.sections == 0 else ",") + ("\n    " if pretty else ""))
+        self.stream.write(json.dumps(name, ensure_ascii=False) + (": " if pretty else ":"))
+        if isinstance(value, list) and len(value) > 0:
+            self.stream.write("[")
+            for (index, entity) in enumerate(value):
+                if index > 0:
+                    self.stream.write(",")
+                if pretty:
+                    self.stream.write("\n        " + self.encode(entity).replace("\n", "\n        "))
+                else:
+                    self.stream.write(self.encode(entity))
+            self.stream.write("\n    ]" if pretty else "]")
+        else:
+            self.stream.write(self.encode(value).replace("\n", "\n    "))
+        self.sections += 1
+    def close(self):
+        if self.stream.closed:
+            return
+        if self.format != "ndjson":
+            self.stream.write(("{" if self.sections == 0 else "\n" if self.format == "json" else "") + "}")
+        self.stream.close()
+def save_hierarchy(structure, file, format="json", compression=None):
+    with HierarchyWriter(file, format, compression) as writer:
+        for (name, value) in structure.items():
+            writer.write_section(name, value)
+def read_section(file, section, format=None, compression=None):
+    # generator over entities of one section, ndjson is scanned line by line and only lines of section are parsed
+    format = format or detect_format(file)
+    compression = compression or detect_compression(file)
+    with open_text(file, "r", compression) as stream:
+        if format == "ndjson":
+            prefix = '{"section":' + json.dumps(section, ensure_ascii=False) + ',"data":'
+            for line in stream:
+                if line.startswith(prefix):
+                    yield json.loads(line)["data"]
+            return
+        value = json.load(stream).get(section, [])
+    yield from (value if isinstance(value, list) else [value])
+def load_hierarchy(file, format=None, compression=None):
+    format = format or detect_format(file)
+    compression = compression or detect_compression(file)
+    with open_text(file, "r", compression) as stream:
+        if format != "ndjson":
+            return json.load(stream)
+        structure = {}
+        for line in stream:
+            record = json.loads(line)
+            if "list" in record:
+                structure[record["section"]] = []
+            elif isinstance(structure.get(record["section"]), list):
+                structure[record["section"]].append(record["data"])
+            else:
+                structure[record["section"]] = record["data"]
+        return structure